@@ -1,22 +1,21 @@
 import os
 import sys
 import json
+import multiprocessing
+import queue
 import shutil
 import subprocess
-import tempfile
 import threading
-import urllib.request
-import zipfile
-from pathlib import Path
+from collections import OrderedDict
 from PIL import Image, ImageTk
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
 
-try:
-    import numpy as np
-    HAS_NUMPY = True
-except ImportError:
-    HAS_NUMPY = False
+from gif_it_engine import (
+    CONFIG_DIR, FolderIndex, FrameCache, JobExecutor, RenderJob, RenderResult, RenderSpec,
+    RenderTrace, check_frames, check_numbering, download_ffmpeg, find_ffmpeg, list_frames,
+    report_paths, resize_from_source,
+)
 
 # ---------------------------------------------------------------------------
 # Try to import tkinterdnd2 for drag-and-drop support
@@ -28,28 +27,23 @@ try:
 except ImportError:
     pass
 
-# ---------------------------------------------------------------------------
-# Try to import imageio for MP4 / H.265 export
-# ---------------------------------------------------------------------------
-try:
-    import imageio.v3 as iio
-    from imageio_ffmpeg import get_ffmpeg_exe as _iio_ffmpeg
-    HAS_IMAGEIO_FFMPEG = True
-except ImportError:
-    HAS_IMAGEIO_FFMPEG = False
-
-SUPPORTED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
-
 # ---------------------------------------------------------------------------
 # Paths & Config
 # ---------------------------------------------------------------------------
-CONFIG_DIR = Path.home() / ".gif_it"
 CONFIG_FILE = CONFIG_DIR / "gif_it_config.json"
 
 DEFAULT_CONFIG = {
     "first_run_done": False,
     "tooltips_enabled": True,
     "theme": "Light",
+    "render_workers": 0,  # frame-processing threads; 0 = one per CPU core
+    "preview_cache_mb": 256,  # memory budget for decoded preview images
+    "frame_cache_mb": 2048,  # on-disk cache of processed frames; 0 = off
+    "memory_budget_mb": 0,  # RAM a render may use; 0 = half the RAM, -1 = no limit
+    "mp4_segments": 1,  # MP4 parts encoded in parallel by separate ffmpeg processes
+    "render_report": False,  # write <output>.report.json with per-stage timings
+    "render_trace": False,  # also write <output>.trace.json for chrome://tracing
+    "preview_prefetch": 4,  # frames decoded ahead/behind the current one
 }
 
 
@@ -83,82 +77,121 @@ def open_file_cross_platform(filepath: str):
         subprocess.Popen(["xdg-open", filepath])
 
 
-FFMPEG_DIR = CONFIG_DIR / "ffmpeg"
-FFMPEG_EXE = FFMPEG_DIR / ("ffmpeg.exe" if sys.platform == "win32" else "ffmpeg")
-
-# URL for gyan.dev release essentials build (Windows, includes libx265)
-FFMPEG_DOWNLOAD_URL = (
-    "https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip"
-)
-
-
-def find_ffmpeg() -> str | None:
-    """Return path to ffmpeg binary, or None."""
-    # 1. Check cached download in ~/.gif_it/ffmpeg/
-    if FFMPEG_EXE.is_file():
-        return str(FFMPEG_EXE)
-    # 2. imageio-ffmpeg (works when running from source with pip install)
-    if HAS_IMAGEIO_FFMPEG:
-        try:
-            return _iio_ffmpeg()
-        except Exception:
-            pass
-    # 3. System PATH
-    return shutil.which("ffmpeg")
-
-
-def download_ffmpeg(progress_callback=None) -> str:
-    """Download ffmpeg essentials build and cache to ~/.gif_it/ffmpeg/.
-
-    Returns the path to ffmpeg.exe on success.
-    Raises RuntimeError on failure.
-    ``progress_callback(percent: float)`` is called with 0-100 values.
+# ---------------------------------------------------------------------------
+# Preview cache
+# ---------------------------------------------------------------------------
+def fit_image(img: Image.Image, box: tuple[int, int]) -> Image.Image:
+    """Scale image to fit ``box`` (width, height) while maintaining aspect ratio."""
+    max_w, max_h = box
+    ratio = min(max_w / img.width, max_h / img.height)
+    if ratio != 1.0:
+        new_size = (max(1, int(img.width * ratio)), max(1, int(img.height * ratio)))
+        img = resize_from_source(img, new_size)
+    return img
+
+
+class PreviewCache:
+    """LRU cache of preview-sized images with a byte budget.
+
+    Entries are keyed by (path, mtime, box), so an edited file or a resized
+    panel simply misses. A single background thread does all decoding:
+    ``request`` renders the frame the user is looking at, and ``prefetch``
+    decodes neighbours when no request is waiting. Both coalesce: a new
+    request replaces one that has not started yet, so holding an arrow key
+    only ever renders the latest frame.
     """
-    FFMPEG_DIR.mkdir(parents=True, exist_ok=True)
-    tmp_zip = FFMPEG_DIR / "ffmpeg_download.zip"
-
-    try:
-        req = urllib.request.urlopen(FFMPEG_DOWNLOAD_URL)
-        total = int(req.headers.get("Content-Length", 0))
-        downloaded = 0
-        chunk_size = 256 * 1024  # 256 KB
-
-        with open(tmp_zip, "wb") as f:
-            while True:
-                chunk = req.read(chunk_size)
-                if not chunk:
-                    break
-                f.write(chunk)
-                downloaded += len(chunk)
-                if progress_callback and total > 0:
-                    progress_callback(downloaded / total * 100)
-
-        # Extract only ffmpeg.exe from the zip
-        with zipfile.ZipFile(tmp_zip, "r") as zf:
-            for name in zf.namelist():
-                basename = os.path.basename(name)
-                if basename.lower() in ("ffmpeg.exe", "ffmpeg"):
-                    with zf.open(name) as src, open(FFMPEG_EXE, "wb") as dst:
-                        shutil.copyfileobj(src, dst)
-                    break
-            else:
-                raise RuntimeError("ffmpeg.exe not found inside downloaded archive.")
 
-        # Make executable on Unix
-        if sys.platform != "win32":
-            os.chmod(FFMPEG_EXE, 0o755)
-
-        return str(FFMPEG_EXE)
-
-    except Exception as e:
-        # Clean up partial download
-        if FFMPEG_EXE.is_file():
-            FFMPEG_EXE.unlink()
-        raise RuntimeError(f"Failed to download ffmpeg: {e}") from e
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._items: OrderedDict[tuple, Image.Image] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._wanted: list[tuple[str, tuple[int, int]]] = []
+        self._request: tuple | None = None
+        self._wake = threading.Condition(self._lock)
+        threading.Thread(target=self._prefetch_loop, daemon=True).start()
+
+    @staticmethod
+    def _key(path: str, box: tuple[int, int]) -> tuple:
+        return (path, os.stat(path).st_mtime_ns, box)
+
+    def get(self, path: str, box: tuple[int, int]) -> Image.Image:
+        """Return the fitted preview for ``path``, decoding it on a miss."""
+        key = self._key(path, box)
+        with self._lock:
+            img = self._items.get(key)
+            if img is not None:
+                self._items.move_to_end(key)
+                return img
+        with Image.open(path) as src:
+            img = fit_image(src, box)
+            if img is src:
+                img = src.copy()  # closing src would discard its pixels
+        self._store(key, img)
+        return img
 
-    finally:
-        if tmp_zip.is_file():
-            tmp_zip.unlink()
+    def peek(self, path: str, box: tuple[int, int]) -> Image.Image | None:
+        """Return the cached preview for ``path`` without decoding, or None."""
+        try:
+            key = self._key(path, box)
+        except OSError:
+            return None
+        with self._lock:
+            img = self._items.get(key)
+            if img is not None:
+                self._items.move_to_end(key)
+            return img
+
+    def request(self, path: str, box: tuple[int, int], callback):
+        """Render ``path`` in the background, then call ``callback(img, error)``.
+
+        The callback runs on the worker thread. A request that has not been
+        picked up yet is dropped in favour of this one.
+        """
+        with self._wake:
+            self._request = (path, box, callback)
+            self._wake.notify()
+
+    def prefetch(self, paths: list[str], box: tuple[int, int]):
+        """Decode ``paths`` in the background, nearest first."""
+        with self._wake:
+            self._wanted = [(p, box) for p in paths]
+            self._wake.notify()
+
+    def _store(self, key: tuple, img: Image.Image):
+        size = img.width * img.height * len(img.getbands())
+        if size > self.budget_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = img
+            self._bytes += size
+            while self._bytes > self.budget_bytes:
+                _, old = self._items.popitem(last=False)
+                self._bytes -= old.width * old.height * len(old.getbands())
+
+    def _prefetch_loop(self):
+        while True:
+            with self._wake:
+                while not self._request and not self._wanted:
+                    self._wake.wait()
+                job, self._request = self._request, None
+                if job is None:
+                    path, box = self._wanted.pop(0)
+            if job is not None:
+                path, box, callback = job
+                try:
+                    img = self.get(path, box)
+                except Exception as e:
+                    callback(None, e)
+                else:
+                    callback(img, None)
+                continue
+            try:
+                self.get(path, box)
+            except Exception:
+                pass  # unreadable files are reported when actually shown
 
 
 # ---------------------------------------------------------------------------
@@ -290,6 +323,144 @@ class GuidedTour:
         save_config(cfg)
 
 
+# ---------------------------------------------------------------------------
+# Virtualized file list
+# ---------------------------------------------------------------------------
+class VirtualFileList(ctk.CTkFrame):
+    """Scrollable list of file names that only creates widgets for visible rows.
+
+    A fixed pool of row buttons is re-labelled as the list scrolls, so
+    loading, reordering and highlighting cost O(visible rows) no matter how
+    many files there are. The list shares the caller's ``items`` list;
+    call ``refresh_rows`` or ``refresh`` after changing it.
+    """
+
+    ROW_HEIGHT = 26  # 24 px button + 1 px padding above and below
+    SELECTED_COLOR = ("#a0d0e0", "#3a5a6a")
+
+    def __init__(self, master, on_select, **kwargs):
+        super().__init__(master, **kwargs)
+        self._on_select = on_select
+        self._items: list[str] = []
+        self._top = 0
+        self._selected = -1
+        self._rows: list[ctk.CTkButton] = []
+
+        self._scrollbar = ctk.CTkScrollbar(self, command=self._on_scrollbar)
+        self._scrollbar.pack(side="right", fill="y")
+        self._body = ctk.CTkFrame(self, fg_color="transparent")
+        self._body.pack(side="left", fill="both", expand=True)
+        self._body.pack_propagate(False)  # rows must never resize the viewport
+        self._body.bind("<Configure>", self._on_resize)
+        self._bind_wheel(self._body)
+
+    # -- public API --
+    def set_items(self, items: list[str]):
+        self._items = items
+        self._top = max(0, min(self._top, len(items) - len(self._rows)))
+        self.refresh()
+
+    def refresh(self):
+        """Re-label every visible row."""
+        for slot in range(len(self._rows)):
+            self._draw_row(slot)
+        self._update_scrollbar()
+
+    def refresh_rows(self, indices):
+        """Re-label only the rows showing the given item indices."""
+        for idx in indices:
+            slot = idx - self._top
+            if 0 <= slot < len(self._rows):
+                self._draw_row(slot)
+
+    def set_selected(self, idx: int):
+        old, self._selected = self._selected, idx
+        if not self.see(idx):
+            self.refresh_rows((old, idx))
+
+    def see(self, idx: int) -> bool:
+        """Scroll so ``idx`` is visible. Returns True if the list scrolled."""
+        visible = len(self._rows)
+        if not visible or not 0 <= idx < len(self._items):
+            return False
+        if idx < self._top:
+            self._top = idx
+        elif idx >= self._top + visible:
+            self._top = idx - visible + 1
+        else:
+            return False
+        self.refresh()
+        return True
+
+    # -- internals --
+    def _draw_row(self, slot: int):
+        idx = self._top + slot
+        btn = self._rows[slot]
+        if idx < len(self._items):
+            color = self.SELECTED_COLOR if idx == self._selected else "transparent"
+            btn.configure(text=self._items[idx], fg_color=color, state="normal")
+        else:
+            btn.configure(text="", fg_color="transparent", state="disabled")
+
+    def _on_resize(self, event):
+        needed = max(1, event.height // self.ROW_HEIGHT)
+        while len(self._rows) < needed:
+            slot = len(self._rows)
+            btn = ctk.CTkButton(
+                self._body, text="", anchor="w",
+                font=ctk.CTkFont(size=11), height=24,
+                fg_color="transparent",
+                text_color=("#000000", "#cccccc"),
+                hover_color=("#c0dfe8", "#3a3a3a"),
+                command=lambda s=slot: self._on_click(s)
+            )
+            btn.pack(fill="x", padx=2, pady=1)
+            self._bind_wheel(btn)
+            self._rows.append(btn)
+        while len(self._rows) > needed:
+            self._rows.pop().destroy()
+        self._top = max(0, min(self._top, len(self._items) - needed))
+        self.refresh()
+
+    def _on_click(self, slot: int):
+        idx = self._top + slot
+        if idx < len(self._items):
+            self._on_select(idx)
+
+    def _scroll_to(self, top: int):
+        top = max(0, min(top, len(self._items) - len(self._rows)))
+        if top != self._top:
+            self._top = top
+            self.refresh()
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self._scroll_to(round(float(value) * len(self._items)))
+        elif action == "scroll":
+            step = len(self._rows) if unit == "pages" else 1
+            self._scroll_to(self._top + int(value) * step)
+
+    def _on_wheel(self, event):
+        if getattr(event, "num", None) == 4:
+            delta = -1
+        elif getattr(event, "num", None) == 5:
+            delta = 1
+        else:
+            delta = -1 if event.delta > 0 else 1
+        self._scroll_to(self._top + delta * 3)
+
+    def _bind_wheel(self, widget):
+        for seq in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            widget.bind(seq, self._on_wheel, add="+")
+
+    def _update_scrollbar(self):
+        n = len(self._items)
+        if n == 0:
+            self._scrollbar.set(0.0, 1.0)
+        else:
+            self._scrollbar.set(self._top / n, min(1.0, (self._top + len(self._rows)) / n))
+
+
 # ---------------------------------------------------------------------------
 # Main Application
 # ---------------------------------------------------------------------------
@@ -338,7 +509,14 @@ class GifItApp(ctk.CTk):
         self.image_files: list[str] = []
         self.preview_index = 0
         self.preview_photo = None  # prevent GC
+        self._preview_cache = PreviewCache(self.config.get("preview_cache_mb", 256) * 1024 * 1024)
+        self._cache: FrameCache | None = None  # created on first render
         self._preview_expanded = False
+        self._jobs = JobExecutor(on_change=self._on_job_change)
+        self._job_states: dict[int, str] = {}  # last state shown for each job
+        self._finished_jobs: set[int] = set()  # done-handling already ran for these
+        self._job_updates: queue.Queue = queue.Queue()  # (job, state, progress) from workers
+        self._closing = False
 
         # ---- Build UI ----
         self._build_controls_panel()
@@ -353,6 +531,9 @@ class GifItApp(ctk.CTk):
         self._register_tour_steps()
         self.after(600, self._maybe_show_tour)
 
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.after(50, self._drain_job_updates)
+
     # ------------------------------------------------------------------
     # Window background color (powder blue in light mode)
     # ------------------------------------------------------------------
@@ -477,6 +658,13 @@ class GifItApp(ctk.CTk):
                                               variable=self.dither_var)
         self.dither_menu.pack(pady=2, fill="x")
 
+        # -- GLOBAL PALETTE --
+        self.global_palette = ctk.BooleanVar(value=False)
+        self.global_palette_check = ctk.CTkCheckBox(self.controls, text="Global Palette",
+                                                     variable=self.global_palette,
+                                                     font=ctk.CTkFont(weight="bold"))
+        self.global_palette_check.pack(pady=(4, 0))
+
         # -- FORMAT --
         self.format_options = ["GIF", "MP4"]
         self.format_var = ctk.StringVar(value="GIF")
@@ -537,9 +725,16 @@ class GifItApp(ctk.CTk):
         self.progress_label = ctk.CTkLabel(self.controls, text="")
         self.progress_label.pack()
 
-        self.status_label = ctk.CTkLabel(self.controls, text="")
+        # Wraps so a long warning doesn't get cut off by the fixed-width panel
+        self.status_label = ctk.CTkLabel(self.controls, text="",
+                                         wraplength=self.COMPACT_WIDTH - 30)
         self.status_label.pack()
 
+        # -- Jobs: running and queued renders --
+        self.jobs_frame = ctk.CTkFrame(self.controls, fg_color="transparent")
+        self.jobs_frame.pack(fill="x")
+        self._job_rows: dict[int, ctk.CTkLabel] = {}
+
         # -- Credits --
         ctk.CTkLabel(self.controls, text="Code by C1t1zen & AI",
                       font=ctk.CTkFont(size=10), text_color="gray").pack(side="bottom", pady=(0, 2))
@@ -611,10 +806,11 @@ class GifItApp(ctk.CTk):
         ctk.CTkLabel(self._filelist_panel, text="FRAME LIST",
                       font=ctk.CTkFont(size=12, weight="bold")).pack(pady=(6, 2))
 
-        # Scrollable list of filenames
-        self.filelist_scroll = ctk.CTkScrollableFrame(
-            self._filelist_panel, fg_color=("#dceef5", "#2a2a2a"))
-        self.filelist_scroll.pack(fill="both", expand=True, padx=4, pady=2)
+        # Scrollable list of filenames (only visible rows are real widgets)
+        self.filelist = VirtualFileList(
+            self._filelist_panel, on_select=self._filelist_select,
+            fg_color=("#dceef5", "#2a2a2a"))
+        self.filelist.pack(fill="both", expand=True, padx=4, pady=2)
 
         # File list action buttons
         fl_btn_frame = ctk.CTkFrame(self._filelist_panel, fg_color="transparent")
@@ -637,9 +833,6 @@ class GifItApp(ctk.CTk):
                                            command=self._filelist_add)
         self._fl_add_btn.pack(side="right", padx=1)
 
-        # Track file list button widgets
-        self._fl_buttons: list[ctk.CTkButton] = []
-
     # ------------------------------------------------------------------
     # Expand / collapse preview
     # ------------------------------------------------------------------
@@ -671,10 +864,7 @@ class GifItApp(ctk.CTk):
 
     def _load_folder(self, folder_path: str):
         self.folder_path = folder_path
-        self.image_files = sorted(
-            f for f in os.listdir(folder_path)
-            if f.lower().endswith(SUPPORTED_EXTENSIONS)
-        )
+        self.image_files = list_frames(folder_path)
         if not self.image_files:
             self.status_label.configure(text="No images found in folder!")
             self._collapse_preview()
@@ -683,38 +873,50 @@ class GifItApp(ctk.CTk):
         self._expand_preview()
         self._rebuild_filelist()
         self._show_preview()
-        self.status_label.configure(text=f"Loaded {len(self.image_files)} frames")
+        text = f"Loaded {len(self.image_files)} frames"
+        numbering = check_numbering(self.image_files)
+        if numbering:
+            text += f". {numbering.describe()}"
+        self.status_label.configure(text=text)
+        # Read every header in the background and flag problems before a render.
+        # Only the fields check_frames reads: a half-typed TIME IT must not stop it.
+        try:
+            dissolve = max(int(self.dissolve_entry.get()), 0)
+        except ValueError:
+            dissolve = 0
+        spec = RenderSpec(folder=folder_path, dissolve=dissolve, fmt=self.format_var.get(),
+                          workers=self.config.get("render_workers", 0))
+        threading.Thread(target=self._index_folder, args=(spec, list(self.image_files)),
+                         daemon=True).start()
+
+    def _index_folder(self, spec: RenderSpec, files: list[str]):
+        try:
+            infos = FolderIndex(spec.folder).scan(files, spec.workers)
+        except OSError:
+            return
+        check = check_frames(infos, spec)
+        problems = check.errors + check.warnings
+        if problems:
+            self.after(0, self._show_frame_problems, spec.folder, problems)
+
+    def _show_frame_problems(self, folder: str, problems: list[str]):
+        if folder != self.folder_path:
+            return  # another folder was loaded meanwhile
+        more = f" (+{len(problems) - 1} more)" if len(problems) > 1 else ""
+        self.status_label.configure(
+            text=f"Loaded {len(self.image_files)} frames. {problems[0]}{more}")
 
     # ------------------------------------------------------------------
     # File list management
     # ------------------------------------------------------------------
     def _rebuild_filelist(self):
-        """Rebuild the scrollable file list from self.image_files."""
-        # Clear existing buttons
-        for btn in self._fl_buttons:
-            btn.destroy()
-        self._fl_buttons.clear()
-
-        for i, fname in enumerate(self.image_files):
-            btn = ctk.CTkButton(
-                self.filelist_scroll, text=fname, anchor="w",
-                font=ctk.CTkFont(size=11), height=24,
-                fg_color="transparent",
-                text_color=("#000000", "#cccccc"),
-                hover_color=("#c0dfe8", "#3a3a3a"),
-                command=lambda idx=i: self._filelist_select(idx)
-            )
-            btn.pack(fill="x", padx=2, pady=1)
-            self._fl_buttons.append(btn)
+        """Point the file list at self.image_files and redraw the visible rows."""
+        self.filelist.set_items(self.image_files)
         self._highlight_filelist()
 
     def _highlight_filelist(self):
         """Highlight the currently selected frame in the file list."""
-        for i, btn in enumerate(self._fl_buttons):
-            if i == self.preview_index:
-                btn.configure(fg_color=("#a0d0e0", "#3a5a6a"))
-            else:
-                btn.configure(fg_color="transparent")
+        self.filelist.set_selected(self.preview_index)
 
     def _filelist_select(self, idx: int):
         """Select a frame by clicking its name in the list."""
@@ -731,7 +933,7 @@ class GifItApp(ctk.CTk):
             self.image_files[idx - 1], self.image_files[idx]
         )
         self.preview_index = idx - 1
-        self._rebuild_filelist()
+        self.filelist.refresh_rows((idx, idx - 1))
         self._show_preview()
 
     def _filelist_move_down(self):
@@ -743,7 +945,7 @@ class GifItApp(ctk.CTk):
             self.image_files[idx + 1], self.image_files[idx]
         )
         self.preview_index = idx + 1
-        self._rebuild_filelist()
+        self.filelist.refresh_rows((idx, idx + 1))
         self._show_preview()
 
     def _filelist_delete(self):
@@ -821,26 +1023,51 @@ class GifItApp(ctk.CTk):
             return
         filename = self.image_files[self.preview_index]
         filepath = os.path.join(self.folder_path, filename)
-        try:
-            img = Image.open(filepath)
-            img = self._fit_image(img)
-            self.preview_photo = ImageTk.PhotoImage(img)
-            self.preview_label.configure(image=self.preview_photo, text="")
-        except Exception as e:
-            self.preview_label.configure(image=None, text=f"Error: {e}")
+        box = self._preview_box()
         self.frame_info.configure(text=f"{self.preview_index + 1} / {len(self.image_files)}")
         self.filename_label.configure(text=filename)
         self._highlight_filelist()
+        # Decoding happens on the cache's worker thread; the previous image
+        # stays up until the new one arrives.
+        img = self._preview_cache.peek(filepath, box)
+        if img is not None:
+            self._display_preview(img)
+        else:
+            self._preview_cache.request(
+                filepath, box,
+                lambda img, err: self.after(0, self._on_preview_rendered, filepath, img, err))
+        self._prefetch_neighbours(box)
 
-    def _fit_image(self, img: Image.Image) -> Image.Image:
-        """Scale image to fit the preview panel while maintaining aspect ratio."""
-        max_w = max(self.preview_label.winfo_width() - 20, 200)
-        max_h = max(self.preview_label.winfo_height() - 20, 200)
-        ratio = min(max_w / img.width, max_h / img.height)
-        if ratio != 1.0:
-            new_size = (max(1, int(img.width * ratio)), max(1, int(img.height * ratio)))
-            img = img.resize(new_size, Image.LANCZOS)
-        return img
+    def _on_preview_rendered(self, filepath: str, img: Image.Image | None, err):
+        """Show a background-rendered preview unless the user has moved on."""
+        if not self.image_files or self.folder_path is None:
+            return
+        current = os.path.join(self.folder_path, self.image_files[self.preview_index])
+        if filepath != current:
+            return
+        if err is not None:
+            self.preview_label.configure(image=None, text=f"Error: {err}")
+        else:
+            self._display_preview(img)
+
+    def _display_preview(self, img: Image.Image):
+        self.preview_photo = ImageTk.PhotoImage(img)
+        self.preview_label.configure(image=self.preview_photo, text="")
+
+    def _preview_box(self) -> tuple[int, int]:
+        """Size the preview image must fit in."""
+        return (max(self.preview_label.winfo_width() - 20, 200),
+                max(self.preview_label.winfo_height() - 20, 200))
+
+    def _prefetch_neighbours(self, box: tuple[int, int]):
+        """Queue the next and previous frames for background decoding."""
+        count = len(self.image_files)
+        depth = min(self.config.get("preview_prefetch", 4), count // 2)
+        order = []
+        for k in range(1, depth + 1):
+            order += [(self.preview_index + k) % count, (self.preview_index - k) % count]
+        self._preview_cache.prefetch(
+            [os.path.join(self.folder_path, self.image_files[i]) for i in order], box)
 
     def _on_preview_resize(self, _event=None):
         """Re-render preview when panel is resized (debounced)."""
@@ -868,10 +1095,20 @@ class GifItApp(ctk.CTk):
         if self.format_var.get() == "MP4" and find_ffmpeg() is None:
             self._prompt_ffmpeg_download()
             return
-        # Run in thread to keep UI responsive
-        self.create_btn.configure(state="disabled")
-        self.status_label.configure(text="Creating...")
-        threading.Thread(target=self._create_animation, daemon=True).start()
+        try:
+            spec = self._render_spec()
+            spec.validate()
+        except ValueError as e:
+            self._creation_error(str(e))
+            return
+        want_report = self.config.get("render_report", False)
+        want_trace = self.config.get("render_trace", False)
+        trace = RenderTrace() if want_report or want_trace else None
+        # Snapshot the list: it may be edited while the job waits or runs
+        job = self._jobs.submit(spec, list(self.image_files),
+                                cache=self._frame_cache(), trace=trace)
+        if len(self._jobs.jobs()) > 1:
+            self.status_label.configure(text=f"Queued {job.name}")
 
     def _prompt_ffmpeg_download(self):
         """Ask the user to download ffmpeg, then retry creation."""
@@ -923,144 +1160,174 @@ class GifItApp(ctk.CTk):
         self._dl_dialog.destroy()
         messagebox.showerror("Download Failed", f"Could not download ffmpeg:\n{error}")
 
-    def _create_animation(self):
-        try:
-            folder = self.folder_path
-            output_name = self.name_entry.get().strip() or os.path.basename(folder)
-            gif_speed = int(self.speed_entry.get())
-            dissolve = int(self.dissolve_entry.get())
-            resample = self.size_slider.get()
-            num_colors = int(self.colors_slider.get())
-            dither_method = self.dither_var.get().strip()
-            fmt = self.format_var.get()
-
-            total = len(self.image_files)
-            images: list[Image.Image] = []
-
-            # ---- Load & process images ----
-            for i, filename in enumerate(self.image_files):
-                img_path = os.path.join(folder, filename)
-                img = Image.open(img_path).convert("RGBA")
-
-                # Resize
-                if resample != 1.0:
-                    new_size = (int(img.width * resample), int(img.height * resample))
-                    img = img.resize(new_size, Image.LANCZOS)
-
-                # Color quantization
-                if num_colors < 256:
-                    img = img.quantize(colors=num_colors).convert("RGBA")
-
-                # Dithering
-                dither_map = {
-                    "NONE": Image.Dither.NONE,
-                    "FLOYDSTEINBERG": Image.Dither.FLOYDSTEINBERG,
-                    "ORDERED": Image.Dither.ORDERED,
-                    "RASTERIZE": Image.Dither.RASTERIZE,
-                }
-                pil_dither = dither_map.get(dither_method, Image.Dither.NONE)
-                img_dithered = img.convert("P", dither=pil_dither).convert("RGBA")
-                images.append(img_dithered)
-
-                # Progress
-                pct = (i + 1) / total
-                self.after(0, self._update_progress, pct)
-
-            # ---- Dissolve ----
-            if dissolve > 0:
-                dissolved: list[Image.Image] = []
-                for i in range(len(images) - 1):
-                    for j in range(dissolve):
-                        alpha = j / dissolve
-                        blend = Image.blend(images[i], images[i + 1], alpha)
-                        dissolved.append(blend)
-                dissolved.append(images[-1])
-                images = dissolved
-
-            # ---- Output ----
-            output_folder = os.path.dirname(folder)
-            output_path = self._save_output(images, output_folder, output_name, gif_speed, fmt)
-
-            self.after(0, self._creation_done, output_path)
-
-        except Exception as e:
-            self.after(0, self._creation_error, str(e))
-
-    def _save_output(self, images: list[Image.Image], output_folder: str,
-                     output_name: str, speed_ms: int, fmt: str) -> str:
-        """Save images as GIF or MP4."""
-        if fmt == "GIF":
-            path = os.path.join(output_folder, output_name + ".gif")
-            # Check overwrite
-            if os.path.exists(path):
-                pass  # TODO: could prompt, but keeping simple for now
-            frames = [img.convert("RGBA") for img in images]
-            frames[0].save(
-                path, save_all=True, append_images=frames[1:],
-                duration=speed_ms, loop=0, optimize=True
-            )
-            return path
-        else:
-            # MP4 (H.265)
-            codec = "libx265"
-            ext = ".mp4"
-            path = os.path.join(output_folder, output_name + ext)
-            ffmpeg_exe = find_ffmpeg()
-            if ffmpeg_exe is None:
-                raise RuntimeError(
-                    "ffmpeg not found. Install imageio[ffmpeg] or add ffmpeg to PATH."
-                )
-            fps = max(1, round(1000 / speed_ms))
-            # Convert PIL images to RGB numpy arrays
-            if not HAS_NUMPY:
-                raise RuntimeError("numpy is required for MP4 export. Install with: pip install numpy")
-            rgb_frames = []
-            for img in images:
-                arr = np.array(img.convert("RGB"))
-                # Ensure even dimensions (required by H.265)
-                h, w = arr.shape[:2]
-                if h % 2 != 0:
-                    arr = arr[:h - 1, :, :]
-                if w % 2 != 0:
-                    arr = arr[:, :w - 1, :]
-                rgb_frames.append(arr)
-
-            # Write frames to temp PNGs and encode via ffmpeg
-            tmpdir = tempfile.mkdtemp(prefix="gifit_")
+    # ------------------------------------------------------------------
+    # Render jobs
+    # ------------------------------------------------------------------
+    def _on_job_change(self, job: RenderJob):
+        """Called on a worker thread; queues a snapshot for the Tk thread.
+
+        Tk must not be touched from here: ``_drain_job_updates`` picks the
+        snapshot up, so the state shown is the one the job had just now.
+        """
+        if job.state == "done":
+            trace = job.render_kwargs.get("trace")
+            if trace is not None and not job.result.up_to_date:
+                report_path, trace_path = report_paths(job.result.output_path)
+                if self.config.get("render_report", False):
+                    trace.write_report(report_path)
+                if self.config.get("render_trace", False):
+                    trace.write_chrome_trace(trace_path)
+        self._job_updates.put((job, job.state, job.progress))
+
+    def _drain_job_updates(self):
+        while True:
             try:
-                for idx, frame_arr in enumerate(rgb_frames):
-                    Image.fromarray(frame_arr).save(
-                        os.path.join(tmpdir, f"frame_{idx:06d}.png")
-                    )
-                subprocess.run([
-                    ffmpeg_exe, "-y", "-framerate", str(fps),
-                    "-i", os.path.join(tmpdir, "frame_%06d.png"),
-                    "-c:v", codec, "-pix_fmt", "yuv420p", path
-                ], check=True, capture_output=True)
-            finally:
-                shutil.rmtree(tmpdir, ignore_errors=True)
-            return path
+                update = self._job_updates.get_nowait()
+            except queue.Empty:
+                break
+            self._job_changed(*update)
+        self.after(50, self._drain_job_updates)
+
+    def _job_changed(self, job: RenderJob, state: str, progress: float):
+        if job.id in self._finished_jobs:
+            return  # a late update for a job already reported as finished
+        if self._job_states.get(job.id) == state:
+            # Just progress: update the bar and the job's row
+            if state == "running":
+                self._update_progress(progress)
+                row = self._job_rows.get(job.id)
+                if row is not None:
+                    row.configure(text=self._job_row_text(job, state, progress))
+            return
+        self._job_states[job.id] = state
+        if state == "running":
+            self._update_progress(0)
+            text = f"Creating {job.name}..."
+            memory = job.memory
+            if memory is not None and (memory.peak_bytes < memory.needed_bytes
+                                       or memory.over_budget):
+                text += f" {memory.describe()}"
+            self.status_label.configure(text=text)
+        elif state == "done":
+            self._creation_done(job.result)
+        elif state == "failed":
+            self._creation_error(job.error)
+        elif state == "cancelled":
+            self._reset_progress()
+            self.status_label.configure(text=f"Cancelled {job.name}")
+        if state in ("done", "failed", "cancelled"):
+            self._finished_jobs.add(job.id)
+            self._job_states.pop(job.id, None)
+        self._refresh_jobs()
+
+    MAX_JOB_ROWS = 4
+
+    def _refresh_jobs(self):
+        """Rebuild the list of running and queued jobs under the status line."""
+        for child in self.jobs_frame.winfo_children():
+            child.destroy()
+        self._job_rows = {}
+        jobs = self._jobs.jobs()
+        for job in jobs[:self.MAX_JOB_ROWS]:
+            row = ctk.CTkFrame(self.jobs_frame, fg_color="transparent")
+            row.pack(fill="x")
+            ctk.CTkButton(row, text="✕", width=24, height=22,
+                          command=lambda j=job: self._jobs.cancel(j)).pack(side="right")
+            if job.state == "queued" and job is not jobs[0]:
+                # Jump the queue: run after whatever is running now
+                top = max(j.priority for j in jobs) + 1
+                ctk.CTkButton(row, text="⇡", width=24, height=22,
+                              command=lambda j=job, p=top: self._jobs.set_priority(j, p)
+                              ).pack(side="right", padx=(0, 2))
+            label = ctk.CTkLabel(row, text=self._job_row_text(job, job.state, job.progress),
+                                 anchor="w", font=ctk.CTkFont(size=11))
+            label.pack(side="left", fill="x", expand=True)
+            self._job_rows[job.id] = label
+        if len(jobs) > self.MAX_JOB_ROWS:
+            ctk.CTkLabel(self.jobs_frame, text=f"+{len(jobs) - self.MAX_JOB_ROWS} more queued",
+                         font=ctk.CTkFont(size=11), text_color="gray").pack()
+
+    @staticmethod
+    def _job_row_text(job: RenderJob, state: str, progress: float) -> str:
+        if state == "running":
+            return f"▶ {job.name}  {int(progress * 100)}%"
+        return f"• {job.name}"
+
+    def _on_close(self):
+        """Stop render jobs cleanly (no half-written files), then quit."""
+        if self._closing:
+            return
+        active = self._jobs.jobs()
+        if active and not messagebox.askyesno(
+                "Quit GIF IT",
+                f"{len(active)} job(s) still running or queued.\n\nCancel them and quit?"):
+            return
+        self._closing = True
+        if active:
+            self.status_label.configure(text="Stopping render jobs...")
+        self._close_when_idle()
+
+    def _close_when_idle(self):
+        """Cancel every job, then poll (not join: Tk keeps running) until the workers exit.
+
+        There is no time limit: quitting with a worker still busy would kill
+        it mid-write. Every stage of a render stops soon after a cancel.
+        """
+        if self._jobs.shutdown(cancel=True, timeout=0):
+            self.destroy()
+        else:
+            self.after(100, self._close_when_idle)
+
+    def _frame_cache(self) -> FrameCache | None:
+        """The processed-frame cache, or None when ``frame_cache_mb`` is 0."""
+        mb = self.config.get("frame_cache_mb", 2048)
+        if mb <= 0:
+            return None
+        if self._cache is None or self._cache.max_bytes != mb << 20:
+            self._cache = FrameCache(max_bytes=mb << 20)
+        return self._cache
+
+    def _render_spec(self) -> RenderSpec:
+        """Collect the current control values into a RenderSpec."""
+        return RenderSpec(
+            folder=self.folder_path,
+            output_name=self.name_entry.get().strip(),
+            speed_ms=int(self.speed_entry.get()),
+            dissolve=int(self.dissolve_entry.get()),
+            scale=self.size_slider.get(),
+            colors=int(self.colors_slider.get()),
+            dither=self.dither_var.get().strip(),
+            fmt=self.format_var.get(),
+            global_palette=self.global_palette.get(),
+            workers=self.config.get("render_workers", 0),
+            segments=self.config.get("mp4_segments", 1),
+            memory_budget_mb=self.config.get("memory_budget_mb", 0),
+        )
 
     def _update_progress(self, pct: float):
         self.progress.set(pct)
         self.progress_label.configure(text=f"{int(pct * 100)}%")
 
-    def _creation_done(self, output_path: str):
+    def _creation_done(self, result: RenderResult):
         self.progress.set(1.0)
         self.progress_label.configure(text="100%")
-        self.status_label.configure(text="Great Success!")
-        self.create_btn.configure(state="normal")
+        text = "Up to date" if result.up_to_date else "Great Success!"
+        if result.warnings:
+            text += f" ({result.warnings[0]})"
+        self.status_label.configure(text=text)
         if self.open_after.get():
-            open_file_cross_platform(output_path)
+            open_file_cross_platform(result.output_path)
         # Reset progress after 8s
         self.after(8000, self._reset_progress)
 
     def _creation_error(self, msg: str):
-        self.status_label.configure(text=f"Error: {msg}")
-        self.create_btn.configure(state="normal")
-        self._reset_progress()
+        self.progress.set(0)
+        self.progress_label.configure(text="")
+        self.status_label.configure(text=f"Error: {msg}")  # kept until the next job
 
     def _reset_progress(self):
+        if any(job.state == "running" for job in self._jobs.jobs()):
+            return  # the bar and status belong to the next job now
         self.progress.set(0)
         self.progress_label.configure(text="")
         self.status_label.configure(text="")
@@ -1077,6 +1344,7 @@ class GifItApp(ctk.CTk):
             self.colors_slider: "Max colors (GIF supports up to 256).",
             self.open_check: "Open the output file after creation.",
             self.dither_menu: "Dithering algorithm for color reduction.",
+            self.global_palette_check: "Share one palette across all frames: smaller GIFs, no color flicker.",
             self.format_menu: "Output format: GIF or MP4 video.",
             self.load_btn: "Browse for a folder of sequentially-named images.",
             self.create_btn: "Create the animation! You can also drag & drop a folder here.",
@@ -1136,5 +1404,6 @@ class GifItApp(ctk.CTk):
 # Entry point
 # ---------------------------------------------------------------------------
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # GIF frames are encoded in worker processes
     app = GifItApp()
     app.mainloop()
@@ -0,0 +1,114 @@
+"""Benchmark: segmented parallel MP4 encoding vs. a single ffmpeg process.
+
+Renders the same synthetic image folder to MP4 once per segment count and
+reports wall time, output size and speedup over one segment. Segments are
+encoded by separate ffmpeg processes that split the CPU cores between
+them, so the gain depends on the core count and the encoder. Each segment
+count is first checked against one process on a short sequence whose
+held frame crosses a segment boundary: the joined file must last exactly
+as long. Exits with status 1 if it does not.
+
+Usage:
+    python benchmarks/bench_mp4_segments.py [--size 1280x720] [--frames 240]
+        [--segments 1,2,4] [--workers 0]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+import gif_it_engine as engine
+
+
+def write_frames(folder: str, width: int, height: int, count: int):
+    """Deterministic moving gradient + noise frames, saved as PNG."""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    for i in range(count):
+        r = np.broadcast_to((x + i * 3) % 256, (height, width))
+        g = np.broadcast_to((y + i * 2) % 256, (height, width))
+        b = rng.integers(0, 32, (height, width)) + 96
+        arr = np.stack([r, g, b], axis=-1).astype(np.uint8)
+        Image.fromarray(arr, "RGB").save(os.path.join(folder, f"frame_{i:05d}.png"),
+                                         compress_level=1)
+
+
+def container_duration(ffmpeg_exe: str, path: str) -> str:
+    """The ``Duration:`` ffmpeg reports for ``path``."""
+    info = subprocess.run([ffmpeg_exe, "-hide_banner", "-i", path],
+                          capture_output=True, text=True).stderr
+    match = re.search(r"Duration: ([\d:.]+)", info)
+    return match.group(1) if match else "?"
+
+
+def check_held_boundary(counts: list[int]) -> bool:
+    """Compare segmented and single-process durations across a held frame."""
+    ffmpeg_exe = engine.select_mp4_encoder()[0]
+    frames = 2 * engine.MIN_SEGMENT_SOURCES + 2
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, "held")
+        os.mkdir(folder)
+        for i in range(frames):
+            # the middle third is one held image, straddling the split
+            value = 128 if frames // 3 <= i < 2 * frames // 3 else i * 8
+            Image.new("RGB", (64, 48), (value, 64, 255 - value)).save(
+                os.path.join(folder, f"held_{i:03d}.png"))
+        files = engine.list_frames(folder)
+        expected = None
+        for segments in sorted({1, *counts}):
+            spec = engine.RenderSpec(folder=folder, output_name=f"held{segments}",
+                                     fmt="MP4", speed_ms=300, segments=segments)
+            duration = container_duration(ffmpeg_exe, engine.render(spec, files).output_path)
+            expected = expected or duration
+            if duration != expected:
+                print(f"  held frames: segments={segments} lasts {duration}, "
+                      f"one process {expected}")
+                ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--frames", type=int, default=240)
+    parser.add_argument("--segments", default="1,2,4",
+                        help="comma-separated segment counts to compare")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="total thread budget (default: CPU count)")
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    counts = [int(v) for v in args.segments.split(",")]
+
+    print(f"{args.frames} frames at {width}x{height}, "
+          f"encoder {engine.select_mp4_encoder()[1]}, {os.cpu_count()} CPUs")
+    if not check_held_boundary(counts):
+        sys.exit(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, "frames")
+        os.mkdir(folder)
+        write_frames(folder, width, height, args.frames)
+        files = engine.list_frames(folder)
+
+        baseline = None
+        for segments in counts:
+            spec = engine.RenderSpec(folder=folder, output_name=f"seg{segments}",
+                                     fmt="MP4", speed_ms=40, segments=segments,
+                                     workers=args.workers)
+            result = engine.render(spec, files, force=True)
+            baseline = baseline or result.seconds
+            print(f"  segments={segments:<3} {result.seconds:7.2f} s  "
+                  f"{result.output_bytes:>11,} bytes  {result.frames_out} frames  "
+                  f"x{baseline / result.seconds:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark: single-pass palette engine vs. the old quantize chain.
+
+The old per-frame path was quantize -> RGBA -> convert("P", dither) ->
+RGBA, followed by another adaptive quantize inside the GIF writer. The new
+path is one ``quantize_frame`` call producing P-mode output.
+
+Usage:
+    python benchmarks/bench_palette.py [--size 1280x720] [--frames 20] [--colors 128]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+import gif_it_engine as engine
+
+
+def make_frames(width: int, height: int, count: int) -> list[Image.Image]:
+    """Deterministic gradient + noise frames."""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frames = []
+    for i in range(count):
+        r = np.broadcast_to((x + i * 7) % 256, (height, width))
+        g = np.broadcast_to(y, (height, width))
+        b = rng.integers(0, 64, (height, width)) + (i * 11) % 192
+        a = np.full((height, width), 255)
+        arr = np.stack([r, g, b, a], axis=-1).astype(np.uint8)
+        frames.append(Image.fromarray(arr, "RGBA"))
+    return frames
+
+
+def legacy_chain(img: Image.Image, num_colors: int, dither_method: str) -> Image.Image:
+    if num_colors < 256:
+        img = img.quantize(colors=num_colors).convert("RGBA")
+    img = img.convert("P", dither=engine.DITHER_MAP[dither_method]).convert("RGBA")
+    return engine._to_gif_frame(img)
+
+
+def time_per_frame(func, frames, *args) -> float:
+    start = time.perf_counter()
+    for img in frames:
+        func(img, *args)
+    return (time.perf_counter() - start) / len(frames) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--colors", type=int, default=128)
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.lower().split("x"))
+
+    frames = make_frames(width, height, args.frames)
+    print(f"{args.frames} frames @ {width}x{height}, {args.colors} colors (ms/frame)")
+    print(f"{'dither':<16}{'old chain':>12}{'single pass':>14}{'saved':>10}")
+    for method in engine.DITHER_MAP:
+        old = time_per_frame(legacy_chain, frames, args.colors, method)
+        new = time_per_frame(engine.quantize_frame, frames, args.colors, method)
+        print(f"{method:<16}{old:>12.1f}{new:>14.1f}{old - new:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
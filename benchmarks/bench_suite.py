@@ -0,0 +1,285 @@
+"""Benchmark suite: the render pipeline over a synthetic corpus and a settings matrix.
+
+Generates deterministic frame folders (gradients, noise, screen-capture-like
+flat regions and photo-like JPEGs at 480p / 1080p / 4K), renders every
+combination of FORMAT, DITHER, COLORS, SIZE and DISSOLVE, and records
+throughput, peak memory and output size for each case to JSON. Each case
+runs in a fresh process so its peak RSS is its own.
+
+Compare a run against a stored baseline to flag regressions; the exit
+status is 1 if any case got slower, bigger or hungrier than the tolerance.
+
+Usage:
+    python benchmarks/bench_suite.py --preset quick --save-baseline baseline.json
+    python benchmarks/bench_suite.py --preset quick --baseline baseline.json
+    python benchmarks/bench_suite.py --corpus screen:1080p:500 --formats GIF \\
+        --dithers NONE,ORDERED --colors 256,64 --sizes 1.0 --dissolves 0
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw
+
+import gif_it_engine as engine
+
+RESOLUTIONS = {"480p": (854, 480), "1080p": (1920, 1080), "4k": (3840, 2160)}
+KINDS = ("gradient", "noise", "screen", "photo")
+
+# corpus specs are "kind:resolution:frames"
+PRESETS = {
+    "smoke": {
+        "corpus": ["screen:480p:10", "gradient:480p:10"],
+        "formats": ["GIF", "MP4"], "dithers": ["NONE"], "colors": [256],
+        "sizes": [1.0], "dissolves": [0],
+    },
+    "quick": {
+        "corpus": [f"{kind}:480p:30" for kind in KINDS],
+        "formats": ["GIF", "MP4"], "dithers": ["NONE", "FLOYDSTEINBERG"],
+        "colors": [256, 64], "sizes": [1.0, 0.5], "dissolves": [0, 2],
+    },
+    "full": {
+        "corpus": [f"{kind}:{res}" for kind in KINDS
+                   for res in ("480p:300", "1080p:100", "4k:10")] + ["screen:480p:10000"],
+        "formats": ["GIF", "MP4"], "dithers": list(engine.DITHER_MAP),
+        "colors": [256, 128, 32], "sizes": [1.0, 0.5, 0.25], "dissolves": [0, 4],
+    },
+}
+
+# Relative growth over the baseline that counts as a regression
+TOLERANCE = {"seconds": 0.10, "peak_rss_bytes": 0.10, "output_bytes": 0.02}
+
+
+# ---------------------------------------------------------------------------
+# Corpus
+# ---------------------------------------------------------------------------
+def _gradient(w: int, h: int, i: int, rng) -> Image.Image:
+    x = np.linspace(0, 255, w, dtype=np.float32)
+    y = np.linspace(0, 255, h, dtype=np.float32)[:, None]
+    r = np.broadcast_to((x + i * 3) % 256, (h, w))
+    g = np.broadcast_to((y + i * 2) % 256, (h, w))
+    b = (r * 0.5 + g * 0.5 + i) % 256
+    return Image.fromarray(np.stack([r, g, b], axis=-1).astype(np.uint8), "RGB")
+
+
+def _noise(w: int, h: int, i: int, rng) -> Image.Image:
+    return Image.fromarray(rng.integers(0, 256, (h, w, 3), dtype=np.uint8), "RGB")
+
+
+def _screen(w: int, h: int, i: int, rng) -> Image.Image:
+    """Flat UI panels and text lines with a small moving region, like a screen capture."""
+    img = Image.new("RGB", (w, h), (236, 238, 241))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, w, h // 14), fill=(45, 52, 64))
+    draw.rectangle((0, h // 14, w // 5, h), fill=(250, 250, 252))
+    line_h = max(6, h // 40)
+    for y in range(h // 10, h - line_h, line_h * 2):
+        length = (y * 7919) % (w // 2) + w // 6
+        draw.rectangle((w // 4, y, w // 4 + length, y + line_h // 2), fill=(90, 96, 108))
+    step = max(1, w // 200)
+    x = w // 4 + (i * step * 3) % (w // 2)
+    draw.rectangle((x, h // 2, x + w // 12, h // 2 + h // 12), fill=(220, 60, 60))
+    draw.rectangle((w // 4, h - 3 * line_h, w // 4 + (i * step) % (w // 2), h - 2 * line_h),
+                   fill=(60, 140, 220))
+    return img
+
+
+def _photo(w: int, h: int, i: int, rng) -> Image.Image:
+    """Smooth colour fields with grain, panned per frame; saved as JPEG."""
+    base = np.random.default_rng(7).integers(0, 256, (12, 20, 3), dtype=np.uint8)
+    field = Image.fromarray(base, "RGB").resize((w + 64, h + 64), Image.BICUBIC)
+    shift = i % 64
+    img = field.crop((shift, shift // 2, shift + w, shift // 2 + h))
+    grain = rng.normal(0, 6, (h, w, 3))
+    return Image.fromarray(np.clip(np.asarray(img) + grain, 0, 255).astype(np.uint8), "RGB")
+
+
+GENERATORS = {"gradient": _gradient, "noise": _noise, "screen": _screen, "photo": _photo}
+
+
+def parse_corpus(spec: str) -> tuple[str, str, int]:
+    kind, res, frames = spec.split(":")
+    if kind not in GENERATORS or res not in RESOLUTIONS:
+        raise ValueError(f"Bad corpus spec {spec!r}; expected kind:resolution:frames "
+                         f"with kind in {KINDS} and resolution in {tuple(RESOLUTIONS)}")
+    return kind, res, int(frames)
+
+
+def ensure_corpus(root: str, spec: str) -> str:
+    """Create (once) the deterministic frame folder for ``spec``; returns its path."""
+    kind, res, frames = parse_corpus(spec)
+    folder = os.path.join(root, f"{kind}_{res}_{frames}")
+    done = os.path.join(folder, ".complete")
+    if os.path.exists(done):
+        return folder
+    os.makedirs(folder, exist_ok=True)
+    w, h = RESOLUTIONS[res]
+    rng = np.random.default_rng(frames)
+    ext = "jpg" if kind == "photo" else "png"
+    for i in range(frames):
+        img = GENERATORS[kind](w, h, i, rng)
+        path = os.path.join(folder, f"frame_{i:05d}.{ext}")
+        if ext == "jpg":
+            img.save(path, quality=90)
+        else:
+            img.save(path, compress_level=1)
+    open(done, "w").close()
+    return folder
+
+
+# ---------------------------------------------------------------------------
+# Cases
+# ---------------------------------------------------------------------------
+def case_key(case: dict) -> str:
+    return (f"{case['corpus']}|{case['fmt']}|{case['dither']}|c{case['colors']}"
+            f"|s{case['scale']}|d{case['dissolve']}")
+
+
+def run_case(folder: str, case: dict, out_dir: str, workers: int, repeat: int) -> dict:
+    """Render one case (in a worker process) and return its metrics."""
+    files = engine.list_frames(folder)
+    spec = engine.RenderSpec(folder=folder, output_name=case_key(case).replace("|", "_"),
+                             speed_ms=40, dissolve=case["dissolve"], scale=case["scale"],
+                             colors=case["colors"], dither=case["dither"], fmt=case["fmt"],
+                             workers=workers, output_folder=out_dir)
+    best = None
+    for _ in range(repeat):
+        trace = engine.RenderTrace()
+        result = engine.render(spec, files, force=True, trace=trace)
+        if best is None or result.seconds < best.seconds:
+            best = result
+    report = best.report
+    os.remove(best.output_path)
+    source_bytes = sum(os.path.getsize(os.path.join(folder, f)) for f in files)
+    return dict(
+        case,
+        key=case_key(case),
+        seconds=round(best.seconds, 4),
+        cpu_seconds=report["cpu_seconds"],
+        frames_in=best.frames_in,
+        frames_out=best.frames_out,
+        frames_per_second=round(best.frames_in / best.seconds, 2),
+        source_mb_per_second=round(source_bytes / 1e6 / best.seconds, 2),
+        output_bytes=best.output_bytes,
+        peak_rss_bytes=report["peak_rss_bytes"],
+        stages={name: stage["wall_seconds"] for name, stage in report["stages"].items()},
+    )
+
+
+def build_cases(args) -> list[dict]:
+    grid = itertools.product(args.corpus, args.formats, args.dithers, args.colors,
+                             args.sizes, args.dissolves)
+    cases = []
+    for corpus, fmt, dither, colors, scale, dissolve in grid:
+        if fmt == "MP4" and colors == 256 and dither != args.dithers[0]:
+            continue  # full-colour MP4 skips quantization, so DITHER changes nothing
+        cases.append(dict(corpus=corpus, fmt=fmt, dither=dither, colors=colors,
+                          scale=scale, dissolve=dissolve))
+    return cases
+
+
+def compare(results: list[dict], baseline: dict) -> list[str]:
+    """Return one line per metric that regressed beyond ``TOLERANCE``."""
+    previous = {c["key"]: c for c in baseline.get("cases", [])}
+    problems = []
+    for case in results:
+        old = previous.get(case["key"])
+        if old is None:
+            continue
+        for metric, tolerance in TOLERANCE.items():
+            before, after = old.get(metric), case.get(metric)
+            if before and after and after > before * (1 + tolerance):
+                problems.append(f"{case['key']}: {metric} {before:,} -> {after:,} "
+                                f"(+{(after / before - 1) * 100:.1f}%)")
+    return problems
+
+
+def machine_info() -> dict:
+    return {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def _list(cast):
+    return lambda text: [cast(v) for v in text.split(",") if v]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--preset", choices=PRESETS, default="quick")
+    parser.add_argument("--corpus", type=_list(str), help="e.g. screen:480p:30,photo:4k:10")
+    parser.add_argument("--formats", type=_list(str.upper))
+    parser.add_argument("--dithers", type=_list(str.upper))
+    parser.add_argument("--colors", type=_list(int))
+    parser.add_argument("--sizes", type=_list(float))
+    parser.add_argument("--dissolves", type=_list(int))
+    parser.add_argument("--workers", type=int, default=0,
+                        help="render threads per case (default: CPU count)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="runs per case; the fastest is kept")
+    parser.add_argument("--corpus-dir",
+                        default=os.path.join(tempfile.gettempdir(), "gif_it_bench_corpus"),
+                        help="where generated frame folders are kept between runs")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--save-baseline", help="also write the results here")
+    args = parser.parse_args()
+    for name, default in PRESETS[args.preset].items():
+        if getattr(args, name) is None:
+            setattr(args, name, default)
+    for spec in args.corpus:
+        parse_corpus(spec)
+
+    cases = build_cases(args)
+    print(f"{len(cases)} cases over {len(args.corpus)} corpora")
+    folders = {spec: ensure_corpus(args.corpus_dir, spec) for spec in args.corpus}
+
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for n, case in enumerate(cases, 1):
+            # A fresh process per case, so peak RSS is the case's own
+            with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+                metrics = pool.submit(run_case, folders[case["corpus"]], case, out_dir,
+                                      args.workers, args.repeat).result()
+            results.append(metrics)
+            print(f"[{n}/{len(cases)}] {metrics['key']:<48} {metrics['seconds']:8.3f} s "
+                  f"{metrics['frames_per_second']:8.1f} fps "
+                  f"{(metrics['peak_rss_bytes'] or 0) / 2**20:7.1f} MiB "
+                  f"{metrics['output_bytes']:>12,} B")
+
+    document = {"machine": machine_info(), "cases": results}
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(document, f, indent=2)
+    print(f"Results: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline)
+        if problems:
+            print(f"{len(problems)} regression(s) against {args.baseline}:")
+            for line in problems:
+                print("  " + line)
+            return 1
+        print(f"No regressions against {args.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""GIF IT command-line batch renderer.
+
+Renders one animation per folder, running several folders at once in a
+process pool. Takes the same NAME / TIME / DISSOLVE / SIZE / COLORS /
+DITHER / FORMAT options as the GUI and writes a JSON summary with one
+entry per job.
+
+Examples:
+    python gif_it_cli.py shots/*/ --format MP4 --jobs 4
+    python gif_it_cli.py "renders/2024-*" --size 0.5 --colors 128 --summary night.json
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from gif_it_engine import (
+    CACHE_DIR, DITHER_MAP, FORMATS, FrameCache, RenderSpec, RenderTrace, list_frames,
+    memory_budget, natural_key, render, report_paths,
+)
+
+
+def expand_folders(patterns: list[str]) -> list[str]:
+    """Expand glob patterns into a de-duplicated, ordered list of folders."""
+    folders: list[str] = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern), key=natural_key) or [pattern]
+        for path in matches:
+            path = os.path.normpath(path)
+            if os.path.isdir(path) and path not in seen:
+                seen.add(path)
+                folders.append(path)
+    return folders
+
+
+def run_job(spec: RenderSpec, cache_mb: int = 0, force: bool = False,
+            report: bool = False, chrome_trace: bool = False) -> dict:
+    """Render one folder; never raises, so one bad folder can't stop the batch.
+
+    ``cache_mb`` > 0 re-uses processed frames from the shared on-disk cache;
+    ``force`` rebuilds outputs that are already up to date. ``report`` and
+    ``chrome_trace`` save per-stage timings next to the output.
+    """
+    entry = {"folder": spec.folder, "output": spec.output_path(), "status": "ok"}
+    start = time.perf_counter()
+    try:
+        files = list_frames(spec.folder)
+        if not files:
+            raise ValueError("No images found in folder")
+        cache = FrameCache(CACHE_DIR, cache_mb << 20) if cache_mb > 0 else None
+        trace = RenderTrace() if report or chrome_trace else None
+        result = render(spec, files, cache=cache, force=force, trace=trace)
+        entry.update(frames_in=result.frames_in, frames_out=result.frames_out,
+                     output_bytes=result.output_bytes, up_to_date=result.up_to_date)
+        if result.warnings:
+            entry["warnings"] = result.warnings
+        if result.memory is not None:
+            entry.update(memory=result.memory.describe(), spilled=result.memory.spill)
+        # A skipped render has nothing to report: keep the last real one
+        if trace is not None and not result.up_to_date:
+            report_path, trace_path = report_paths(result.output_path)
+            if report:
+                trace.write_report(report_path)
+                entry["report"] = report_path
+            if chrome_trace:
+                trace.write_chrome_trace(trace_path)
+                entry["chrome_trace"] = trace_path
+    except Exception as e:
+        entry.update(status="error", error=str(e))
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="gif_it_cli",
+        description="Render a GIF or MP4 from each folder of images.")
+    parser.add_argument("folders", nargs="+",
+                        help="image folders or glob patterns matching folders")
+    parser.add_argument("-n", "--name", default="",
+                        help="output name; '{folder}' is replaced by the folder name "
+                             "(default: the folder name)")
+    parser.add_argument("-t", "--time", type=int, default=100, dest="speed_ms",
+                        help="frame duration in milliseconds (default: 100)")
+    parser.add_argument("-d", "--dissolve", type=int, default=0,
+                        help="blend frames between each image (default: 0)")
+    parser.add_argument("-s", "--size", type=float, default=1.0, dest="scale",
+                        help="scale factor, 0.1-8.0 (default: 1.0)")
+    parser.add_argument("-c", "--colors", type=int, default=256,
+                        help="maximum palette colors, 1-256 (default: 256)")
+    parser.add_argument("--dither", choices=list(DITHER_MAP), default="NONE",
+                        type=str.upper)
+    parser.add_argument("-f", "--format", choices=FORMATS, default="GIF",
+                        type=str.upper, dest="fmt")
+    parser.add_argument("--global-palette", action="store_true",
+                        help="share one palette across all frames")
+    parser.add_argument("-o", "--output-dir", default=None,
+                        help="where to write outputs (default: each folder's parent)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="folders rendered at once (default: CPU count)")
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="frame threads per job (default: CPU count / jobs)")
+    parser.add_argument("--segments", type=int, default=1,
+                        help="MP4: encode each job in this many parallel parts, "
+                             "sharing the job's threads (default: 1)")
+    parser.add_argument("--cache-mb", type=int, default=2048,
+                        help=f"size limit of the processed-frame cache in {CACHE_DIR} "
+                             "(default: 2048)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="don't read or write the processed-frame cache")
+    parser.add_argument("--memory-mb", type=int, default=0,
+                        help="RAM all jobs together may use; frames that don't fit "
+                             "spill to disk (default: 0 = half the RAM, -1 = no limit)")
+    parser.add_argument("--force", action="store_true",
+                        help="re-render even when an output is up to date")
+    parser.add_argument("--report", action="store_true",
+                        help="write per-stage timings to <output>.report.json")
+    parser.add_argument("--chrome-trace", action="store_true",
+                        help="write every timed span to <output>.trace.json "
+                             "(open in chrome://tracing or ui.perfetto.dev)")
+    parser.add_argument("--summary", default="gif_it_summary.json",
+                        help="JSON file receiving one entry per job "
+                             "(default: gif_it_summary.json)")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    folders = expand_folders(args.folders)
+    if not folders:
+        print("No folders matched.", file=sys.stderr)
+        return 2
+
+    jobs = max(1, min(args.jobs, len(folders)))
+    # Split the cores between jobs so the pool doesn't oversubscribe the machine
+    workers = args.workers or max(1, (os.cpu_count() or 1) // jobs)
+    # ... and the memory budget
+    budget = memory_budget(args.memory_mb)
+    job_budget_mb = -1 if budget is None else max(1, (budget >> 20) // jobs)
+    specs = [
+        RenderSpec(
+            folder=folder,
+            output_name=args.name.replace("{folder}", os.path.basename(folder)),
+            speed_ms=args.speed_ms, dissolve=args.dissolve, scale=args.scale,
+            colors=args.colors, dither=args.dither, fmt=args.fmt,
+            global_palette=args.global_palette, workers=workers,
+            output_folder=args.output_dir, segments=args.segments,
+            memory_budget_mb=job_budget_mb,
+        )
+        for folder in folders
+    ]
+    try:
+        specs[0].validate()
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    # Two jobs writing one file would silently keep only the last
+    owners = {}
+    for spec in specs:
+        key = os.path.normcase(os.path.abspath(spec.output_path()))
+        if key in owners:
+            print(f"Error: {owners[key]} and {spec.folder} would both be written to "
+                  f"{spec.output_path()}; render them in separate runs or without "
+                  "--output-dir.", file=sys.stderr)
+            return 2
+        owners[key] = spec.folder
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    summary = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        cache_mb = 0 if args.no_cache else args.cache_mb
+        futures = [pool.submit(run_job, spec, cache_mb, args.force,
+                               args.report, args.chrome_trace) for spec in specs]
+        for done, future in enumerate(as_completed(futures), 1):
+            entry = future.result()
+            summary.append(entry)
+            if entry.get("up_to_date"):
+                detail = "up to date"
+            elif entry["status"] == "ok":
+                detail = f"{entry['frames_out']} frames, {entry['output_bytes']:,} bytes"
+            else:
+                detail = entry["error"]
+            print(f"[{done}/{len(specs)}] {entry['status'].upper():5} "
+                  f"{entry['folder']} -> {entry['output']} ({detail}, {entry['seconds']}s)")
+            for warning in entry.get("warnings", ()):
+                print(f"    warning: {warning}")
+
+    summary.sort(key=lambda e: folders.index(e["folder"]))
+    failed = sum(e["status"] != "ok" for e in summary)
+    skipped = sum(bool(e.get("up_to_date")) for e in summary)
+    with open(args.summary, "w") as f:
+        json.dump({"jobs": summary, "failed": failed, "up_to_date": skipped,
+                   "seconds": round(time.perf_counter() - start, 3)}, f, indent=2)
+    print(f"{len(summary) - failed} ok ({skipped} up to date), {failed} failed. "
+          f"Summary: {args.summary}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2356 @@
+"""GIF IT rendering engine.
+
+Everything needed to turn a folder of images into a GIF or MP4, with no
+dependency on Tk: the GUI builds a RenderSpec from its widgets and calls
+``render``, and the same call works on headless machines and in worker
+processes.
+"""
+import contextvars
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import shutil
+import subprocess
+import tempfile
+import time
+import urllib.request
+import weakref
+import zipfile
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from functools import partial
+from pathlib import Path
+from PIL import Image, ImageChops, GifImagePlugin
+
+try:
+    import resource  # peak RSS and child CPU time; not available on Windows
+except ImportError:
+    resource = None
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# ---------------------------------------------------------------------------
+# Try to import imageio for MP4 / H.265 export
+# ---------------------------------------------------------------------------
+try:
+    import imageio.v3 as iio
+    from imageio_ffmpeg import get_ffmpeg_exe as _iio_ffmpeg
+    HAS_IMAGEIO_FFMPEG = True
+except ImportError:
+    HAS_IMAGEIO_FFMPEG = False
+
+SUPPORTED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
+FORMATS = ("GIF", "MP4")
+
+# ---------------------------------------------------------------------------
+# Paths & ffmpeg
+# ---------------------------------------------------------------------------
+CONFIG_DIR = Path.home() / ".gif_it"
+CACHE_DIR = CONFIG_DIR / "cache"
+# Not the temp dir: that is often RAM-backed (tmpfs), which defeats spilling
+SPILL_DIR = CONFIG_DIR / "spill"
+INDEX_DIR = CONFIG_DIR / "index"
+
+FFMPEG_DIR = CONFIG_DIR / "ffmpeg"
+FFMPEG_EXE = FFMPEG_DIR / ("ffmpeg.exe" if sys.platform == "win32" else "ffmpeg")
+
+# URL for gyan.dev release essentials build (Windows, includes libx265)
+FFMPEG_DOWNLOAD_URL = (
+    "https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip"
+)
+
+
+FFMPEG_PROBE_FILE = CONFIG_DIR / "ffmpeg_probe.json"
+
+# MP4 encoders in order of preference; the first one the binary has is used
+MP4_ENCODERS = ("libx265", "libx264", "mpeg4")
+
+# Oldest ffmpeg release with every option encode_mp4_stream uses
+# (-enc_time_base); -fps_mode only exists from 5.1, older ones get -vsync.
+MIN_FFMPEG_VERSION = (4, 2)
+_FPS_MODE_VERSION = (5, 1)
+
+_found_ffmpeg: str | None = None
+_probes: dict[str, tuple[list, "FfmpegCaps"]] = {}  # path -> (file stamp, caps)
+
+
+def find_ffmpeg(refresh: bool = False) -> str | None:
+    """Return path to ffmpeg binary, or None.
+
+    The result is remembered for the life of the process (as long as the
+    file still exists); pass ``refresh=True`` to search again.
+    """
+    global _found_ffmpeg
+    if not refresh and _found_ffmpeg is not None and os.path.isfile(_found_ffmpeg):
+        return _found_ffmpeg
+    _found_ffmpeg = _search_ffmpeg()
+    return _found_ffmpeg
+
+
+def _search_ffmpeg() -> str | None:
+    # 1. Check cached download in ~/.gif_it/ffmpeg/
+    if FFMPEG_EXE.is_file():
+        return str(FFMPEG_EXE)
+    # 2. imageio-ffmpeg (works when running from source with pip install)
+    if HAS_IMAGEIO_FFMPEG:
+        try:
+            return _iio_ffmpeg()
+        except Exception:
+            pass
+    # 3. System PATH
+    return shutil.which("ffmpeg")
+
+
+@dataclass
+class FfmpegCaps:
+    """What an ffmpeg binary can do, as reported by the binary itself."""
+    path: str
+    version: str
+    encoders: frozenset
+    pix_fmts: frozenset
+
+    @property
+    def release(self) -> tuple[int, int] | None:
+        """(major, minor) of a release build, or None for a git snapshot."""
+        m = re.search(r"version\s+n?(\d+)\.(\d+)", self.version)
+        return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+def _ffmpeg_list(exe: str, option: str) -> list[str]:
+    """Names from an ``ffmpeg -encoders`` / ``-pix_fmts`` style table."""
+    out = subprocess.run([exe, "-hide_banner", option], capture_output=True,
+                         text=True, timeout=30, check=True).stdout
+    names, in_table = [], False
+    for line in out.splitlines():
+        if in_table:
+            parts = line.split()
+            if len(parts) >= 2:
+                names.append(parts[1])
+        elif line.strip().startswith("---"):
+            in_table = True
+    return names
+
+
+def probe_ffmpeg(exe: str) -> FfmpegCaps:
+    """Return the version, encoders and pixel formats of ``exe``.
+
+    Probing runs the binary three times, so results are kept in
+    ``~/.gif_it/ffmpeg_probe.json`` and only redone when the binary's size
+    or modification time changes.
+    """
+    exe = os.path.abspath(exe)
+    st = os.stat(exe)
+    stamp = [st.st_size, st.st_mtime_ns]
+    known = _probes.get(exe)
+    if known is not None and known[0] == stamp:
+        return known[1]
+    try:
+        with open(FFMPEG_PROBE_FILE, "r") as f:
+            stored = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        stored = {}
+    entry = stored.get(exe)
+    if entry is None or entry.get("stamp") != stamp:
+        version = subprocess.run([exe, "-hide_banner", "-version"], capture_output=True,
+                                 text=True, timeout=30, check=True).stdout
+        entry = {
+            "stamp": stamp,
+            "version": (version.splitlines() or [""])[0].split(" Copyright")[0].strip(),
+            "encoders": _ffmpeg_list(exe, "-encoders"),
+            "pix_fmts": _ffmpeg_list(exe, "-pix_fmts"),
+        }
+        stored[exe] = entry
+        CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = FFMPEG_PROBE_FILE.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(stored, indent=1))
+        os.replace(tmp, FFMPEG_PROBE_FILE)
+    caps = FfmpegCaps(exe, entry["version"], frozenset(entry["encoders"]),
+                      frozenset(entry["pix_fmts"]))
+    _probes[exe] = (stamp, caps)
+    return caps
+
+
+def select_mp4_encoder(preferred: tuple = MP4_ENCODERS) -> tuple[str, str]:
+    """Return ``(ffmpeg path, encoder)`` for MP4 export.
+
+    Raises RuntimeError if ffmpeg is missing or can't encode any of
+    ``preferred``, so a render can fail before it decodes a single frame.
+    """
+    exe = find_ffmpeg()
+    if exe is None:
+        raise RuntimeError(
+            "ffmpeg not found. Install imageio[ffmpeg] or add ffmpeg to PATH."
+        )
+    try:
+        caps = probe_ffmpeg(exe)
+    except (OSError, subprocess.SubprocessError) as e:
+        raise RuntimeError(f"Could not run ffmpeg at {exe}: {e}") from e
+    if caps.release is not None and caps.release < MIN_FFMPEG_VERSION:
+        raise RuntimeError(
+            f"ffmpeg at {exe} is too old ({caps.version}); MP4 export needs "
+            f"ffmpeg {'.'.join(map(str, MIN_FFMPEG_VERSION))} or newer.")
+    if not {"rgb24", "yuv420p"} <= caps.pix_fmts:
+        raise RuntimeError(f"ffmpeg at {exe} lacks the rgb24/yuv420p pixel formats.")
+    for encoder in preferred:
+        if encoder in caps.encoders:
+            return exe, encoder
+    raise RuntimeError(
+        f"ffmpeg at {exe} ({caps.version}) has none of the encoders "
+        f"{', '.join(preferred)}.")
+
+
+def download_ffmpeg(progress_callback=None) -> str:
+    """Download ffmpeg essentials build and cache to ~/.gif_it/ffmpeg/.
+
+    Returns the path to ffmpeg.exe on success.
+    Raises RuntimeError on failure.
+    ``progress_callback(percent: float)`` is called with 0-100 values.
+    """
+    FFMPEG_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_zip = FFMPEG_DIR / "ffmpeg_download.zip"
+
+    try:
+        req = urllib.request.urlopen(FFMPEG_DOWNLOAD_URL)
+        total = int(req.headers.get("Content-Length", 0))
+        downloaded = 0
+        chunk_size = 256 * 1024  # 256 KB
+
+        with open(tmp_zip, "wb") as f:
+            while True:
+                chunk = req.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                downloaded += len(chunk)
+                if progress_callback and total > 0:
+                    progress_callback(downloaded / total * 100)
+
+        # Extract only ffmpeg.exe from the zip
+        with zipfile.ZipFile(tmp_zip, "r") as zf:
+            for name in zf.namelist():
+                basename = os.path.basename(name)
+                if basename.lower() in ("ffmpeg.exe", "ffmpeg"):
+                    with zf.open(name) as src, open(FFMPEG_EXE, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    break
+            else:
+                raise RuntimeError("ffmpeg.exe not found inside downloaded archive.")
+
+        # Make executable on Unix
+        if sys.platform != "win32":
+            os.chmod(FFMPEG_EXE, 0o755)
+
+        return find_ffmpeg(refresh=True)
+
+    except Exception as e:
+        # Clean up partial download
+        if FFMPEG_EXE.is_file():
+            FFMPEG_EXE.unlink()
+        raise RuntimeError(f"Failed to download ffmpeg: {e}") from e
+
+    finally:
+        if tmp_zip.is_file():
+            tmp_zip.unlink()
+
+
+# Rows appended below every frame sent to ffmpeg. They are blank except on the
+# last few frames, where each has its own value: those frames then survive
+# duplicate dropping even inside a hold and keep their regular spacing. The
+# MP4 muxer derives the file's duration from decode timestamps, which lag the
+# presentation ones by the encoder's B-frame delay, so the tail must be
+# regular for that duration to end exactly at the last frame's end.
+_END_MARK_ROWS = 8  # one mpdecimate block
+_END_MARK_FRAMES = 4  # > any B-frame reorder delay of the encoders we pick
+
+
+def encode_mp4_stream(frames, path: str, ffmpeg_exe: str, frame_ms: int,
+                      codec: str = "libx265", threads: int = 0,
+                      cancel: threading.Event | None = None) -> int:
+    """Encode frames to video by piping raw RGB24 bytes into ffmpeg's stdin.
+
+    Frames are converted and written one at a time as they are produced, so
+    nothing is staged on disk. Each frame lasts exactly ``frame_ms``: the
+    input rate is the rational 1000/``frame_ms`` and the file's timescale is
+    milliseconds. Runs of identical frames are dropped to one frame that is
+    held for the whole run (variable frame rate), so held frames cost
+    nothing to encode. Odd dimensions are cropped to even (required by
+    yuv420p). ``threads`` > 0 caps the encoder's threads. Setting ``cancel``
+    kills ffmpeg even while it finishes encoding. Returns the number of
+    frames written; raises RuntimeError with ffmpeg's stderr if encoding
+    fails.
+    """
+    proc = None
+    size = None
+    count = 0
+    pending = deque()  # held back so the last few can be marked
+    # stderr goes to a temp file so a chatty encoder can never fill the pipe
+    # and deadlock against our writes to stdin.
+    with tempfile.TemporaryFile() as errlog:
+        try:
+            for img in frames:
+                if img.mode != "RGB":
+                    img = img.convert("RGB")
+                if proc is None:
+                    w, h = img.width - img.width % 2, img.height - img.height % 2
+                    if w == 0 or h == 0:
+                        raise RuntimeError("Frames are too small to encode as video.")
+                    size = (w, h)
+                    blank = bytes(w * 3 * _END_MARK_ROWS)
+                    proc = subprocess.Popen([
+                        ffmpeg_exe, "-y", "-loglevel", "error",
+                        "-f", "rawvideo", "-pix_fmt", "rgb24",
+                        "-s", f"{w}x{h + _END_MARK_ROWS}",
+                        "-framerate", f"1000/{frame_ms}", "-i", "-",
+                        # drop exact repeats, then cut the marker rows off
+                        "-vf", f"mpdecimate=hi=0:lo=0:frac=0,crop={w}:{h}:0:0",
+                        *_vfr_args(ffmpeg_exe), "-enc_time_base", "-1",
+                        "-video_track_timescale", "1000",
+                        "-c:v", codec, *_thread_args(codec, threads),
+                        "-pix_fmt", "yuv420p", path
+                    ], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=errlog)
+                if img.size != size:
+                    if img.width - size[0] in (0, 1) and img.height - size[1] in (0, 1):
+                        img = img.crop((0, 0) + size)  # drop the odd row/column
+                    else:
+                        img = img.resize(size, Image.LANCZOS)
+                if len(pending) == _END_MARK_FRAMES:
+                    with span("encode"):  # blocks while ffmpeg catches up
+                        proc.stdin.write(pending.popleft())
+                        proc.stdin.write(blank)
+                pending.append(img.tobytes())
+                count += 1
+            if proc is None:
+                raise RuntimeError("No frames to encode.")
+            with span("encode"):
+                for i, data in enumerate(pending, 1):
+                    proc.stdin.write(data)
+                    proc.stdin.write(bytes([i * 32]) * len(blank))
+                proc.stdin.close()
+                returncode = _wait(proc, cancel)
+        except BrokenPipeError:
+            # ffmpeg exited early; its stderr says why
+            returncode = proc.wait()
+        finally:
+            if proc is not None and proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        if returncode != 0:
+            errlog.seek(0)
+            raise RuntimeError(
+                f"ffmpeg failed: {errlog.read().decode(errors='replace').strip()}")
+    return count
+
+
+def _wait(proc: subprocess.Popen, cancel: threading.Event | None) -> int:
+    """``proc.wait()``, but kill ``proc`` and raise RenderCancelled once ``cancel`` is set."""
+    while cancel is not None:
+        try:
+            return proc.wait(timeout=0.1)
+        except subprocess.TimeoutExpired:
+            if cancel.is_set():
+                proc.kill()
+                proc.wait()
+                raise RenderCancelled("Cancelled")
+    return proc.wait()
+
+
+def _vfr_args(ffmpeg_exe: str) -> list[str]:
+    """Variable frame rate output, spelled the way ``ffmpeg_exe`` understands."""
+    release = probe_ffmpeg(ffmpeg_exe).release
+    if release is not None and release < _FPS_MODE_VERSION:
+        return ["-vsync", "vfr"]
+    return ["-fps_mode", "vfr"]
+
+
+def _thread_args(codec: str, threads: int) -> list[str]:
+    if threads <= 0:
+        return []
+    args = ["-threads", str(threads)]
+    if codec == "libx265":
+        # x265 sizes its worker pool from its own "pools" option
+        args += ["-x265-params", f"pools={threads}:log-level=error"]
+    return args
+
+
+def encode_mp4_segments(streams: list, path: str, ffmpeg_exe: str, frame_ms: int,
+                        codec: str = "libx265", threads: int = 0,
+                        cancel: threading.Event | None = None) -> int:
+    """Encode consecutive frame streams in parallel and join them into one MP4.
+
+    Each stream becomes its own segment, encoded by its own ffmpeg process
+    (so each starts on a keyframe), with ``threads`` encoder threads apiece.
+    The segments are then concatenated with the concat demuxer and stream
+    copy, without re-encoding; each starts exactly where the frames before
+    it end. Returns the total number of frames written.
+    """
+    out_dir = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryDirectory(prefix=".gif_it_segments_", dir=out_dir) as tmp:
+        seg_paths = [os.path.join(tmp, f"segment{i:04d}.mp4") for i in range(len(streams))]
+        with ThreadPoolExecutor(len(streams)) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, encode_mp4_stream,
+                                   frames, seg, ffmpeg_exe, frame_ms, codec, threads, cancel)
+                       for frames, seg in zip(streams, seg_paths)]
+            counts = [f.result() for f in futures]
+        listing = os.path.join(tmp, "segments.ffconcat")
+        with open(listing, "w") as f:
+            f.write("ffconcat version 1.0\n")
+            for seg, count in zip(seg_paths, counts):
+                # Start each segment where the previous one's frames end
+                f.write(f"file '{os.path.basename(seg)}'\n"
+                        f"duration {count * frame_ms / 1000:.3f}\n")
+        with span("write"), tempfile.TemporaryFile() as errlog:
+            proc = subprocess.Popen([
+                ffmpeg_exe, "-y", "-loglevel", "error", "-f", "concat", "-i", listing,
+                "-c", "copy", "-video_track_timescale", "1000", path
+            ], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=errlog)
+            try:
+                returncode = _wait(proc, cancel)
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+            if returncode != 0:
+                errlog.seek(0)
+                raise RuntimeError("ffmpeg failed to join segments: "
+                                   f"{errlog.read().decode(errors='replace').strip()}")
+    return sum(counts)
+
+
+# ---------------------------------------------------------------------------
+# Render tracing
+# ---------------------------------------------------------------------------
+# Stages reported for every traced render, in pipeline order
+TRACE_STAGES = ("decode", "resize", "quantize", "dither", "dissolve", "encode", "write")
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("gif_it_trace", default=None)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _peak_rss() -> int | None:
+    """High-water mark of this process's resident memory, in bytes."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KiB
+
+
+def _children_cpu() -> float:
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start", "cpu")
+
+    def __init__(self, trace: "RenderTrace", name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, self.start, time.perf_counter() - self.start,
+                       time.thread_time() - self.cpu)
+        return False
+
+
+def span(name: str):
+    """Time the enclosed block as stage ``name`` of the active trace, if any."""
+    trace = _current_trace.get()
+    return _NULL_SPAN if trace is None else _Span(trace, name)
+
+
+def _count_bytes(name: str, count: int):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_bytes(name, count)
+
+
+class RenderTrace:
+    """Per-stage timings of one render.
+
+    Pass one to ``render(trace=...)``; the pipeline records a span for each
+    piece of work (wall time and the CPU time of the thread that did it),
+    in every worker thread and encoder process. ``report()`` sums them per
+    stage and ``write_chrome_trace()`` saves every span for
+    chrome://tracing or https://ui.perfetto.dev.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans: list[tuple] = []  # (stage, start, seconds, cpu, pid, tid)
+        self._bytes: dict[str, int] = {}
+        self._extra_cpu: dict[str, float] = {}
+        self._threads: dict[int, str] = {}
+        self.totals: dict = {}
+
+    def add(self, name: str, start: float, seconds: float, cpu: float,
+            pid: int | None = None, tid: int | None = None):
+        """Record one span; ``pid``/``tid`` default to the calling thread."""
+        if tid is None:
+            tid = threading.get_ident()
+            if tid not in self._threads:
+                self._threads[tid] = threading.current_thread().name
+        self.spans.append((name, start, seconds, cpu, pid or os.getpid(), tid))
+
+    def add_bytes(self, name: str, count: int):
+        self._bytes[name] = self._bytes.get(name, 0) + count
+
+    def add_cpu(self, name: str, seconds: float):
+        """Charge CPU time spent outside this process (e.g. in ffmpeg) to ``name``."""
+        self._extra_cpu[name] = self._extra_cpu.get(name, 0.0) + seconds
+
+    def report(self) -> dict:
+        """Totals plus wall/CPU seconds and bytes for each stage.
+
+        A stage's wall time is the sum of its spans, so stages that ran on
+        several threads at once can add up to more than the render took.
+        Stages share one process and run at the same time, so memory is
+        only reported for the whole job (``peak_rss_bytes`` in the totals).
+        """
+        stages = {name: {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0}
+                  for name in TRACE_STAGES}
+        for name, _, seconds, cpu, _, _ in list(self.spans):
+            stage = stages.setdefault(name, {"calls": 0, "wall_seconds": 0.0,
+                                             "cpu_seconds": 0.0})
+            stage["calls"] += 1
+            stage["wall_seconds"] += seconds
+            stage["cpu_seconds"] += cpu
+        for name, stage in stages.items():
+            stage["cpu_seconds"] += self._extra_cpu.get(name, 0.0)
+            stage["wall_seconds"] = round(stage["wall_seconds"], 6)
+            stage["cpu_seconds"] = round(stage["cpu_seconds"], 6)
+            stage["bytes"] = self._bytes.get(name, 0)
+        return dict(self.totals, stages=stages)
+
+    def write_report(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_chrome_trace(self, path: str):
+        """Save every span in Chrome's trace event format."""
+        events = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                   "args": {"name": name}} for tid, name in self._threads.items()]
+        for name, start, seconds, cpu, pid, tid in list(self.spans):
+            events.append({
+                "name": name, "cat": "render", "ph": "X", "pid": pid, "tid": tid,
+                "ts": round((start - self.origin) * 1e6, 1),
+                "dur": round(seconds * 1e6, 1),
+                "args": {"cpu_ms": round(cpu * 1000, 3)},
+            })
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+# ---------------------------------------------------------------------------
+# Streaming frame pipeline
+# ---------------------------------------------------------------------------
+DITHER_MAP = {
+    "NONE": Image.Dither.NONE,
+    "FLOYDSTEINBERG": Image.Dither.FLOYDSTEINBERG,
+    "ORDERED": Image.Dither.ORDERED,
+    "RASTERIZE": Image.Dither.RASTERIZE,
+}
+
+# Pillow only implements Floyd-Steinberg error diffusion; every other dither
+# value silently falls back to it. ORDERED and RASTERIZE are done here with
+# Bayer threshold matrices instead (8x8 and a coarser 4x4 respectively).
+_BAYER_SIZE = {"ORDERED": 8, "RASTERIZE": 4}
+
+# Alpha below 128 becomes the reserved transparent palette index
+_ALPHA_CUTOFF = [255] * 128 + [0] * 128
+
+
+def resolve_workers(requested: int) -> int:
+    """Return the worker count to use; 0 or less means one per CPU core."""
+    if requested and requested > 0:
+        return requested
+    return os.cpu_count() or 1
+
+
+def ordered_map(func, items, workers: int):
+    """Like ``map()``, but runs ``func`` on a thread pool.
+
+    Results are yielded in input order. Items are pulled lazily and at most
+    ``2 * workers`` results are in flight, so memory stays bounded however
+    long ``items`` is. Decoding and most Pillow operations release the GIL,
+    so threads give real parallelism here.
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        try:
+            for item in items:
+                # Workers see the caller's context (e.g. the active trace)
+                pending.append(pool.submit(contextvars.copy_context().run, func, item))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def resize_from_source(img: Image.Image, size: tuple[int, int]) -> Image.Image:
+    """Resize a freshly opened image to ``size``, decoding as little as possible.
+
+    When shrinking a JPEG, ``draft`` makes the decoder produce a 1/2, 1/4 or
+    1/8 scale image that is still at least twice the target size. Any
+    format is then box-reduced by an integer factor (``reducing_gap``)
+    before the final LANCZOS pass, so a large downscale never filters the
+    full-resolution image. Call it before ``load()``; afterwards ``draft``
+    is a no-op.
+    """
+    if _draft_for(img, size):
+        return img.resize(size, Image.LANCZOS, reducing_gap=2.0)
+    return img.resize(size, Image.LANCZOS)
+
+
+def _draft_for(img: Image.Image, size: tuple[int, int]) -> bool:
+    """Ask the decoder for a reduced image if ``size`` is at least a 2x shrink."""
+    if size[0] * 2 <= img.width and size[1] * 2 <= img.height:
+        img.draft(img.mode, (size[0] * 2, size[1] * 2))
+        return True
+    return False
+
+
+def load_frame(path: str, resample: float) -> Image.Image:
+    """Decode one source image to RGBA and apply the SIZE scale factor."""
+    with span("decode"):
+        img = Image.open(path)
+        size = (max(1, int(img.width * resample)), max(1, int(img.height * resample)))
+        shrink = resample != 1.0 and _draft_for(img, size)
+        img.load()
+        if img.mode in ("1", "P"):
+            img = img.convert("RGBA")  # resize() would fall back to NEAREST for these
+        if resample == 1.0:
+            return img.convert("RGBA")
+    with span("resize"):
+        img = img.resize(size, Image.LANCZOS, reducing_gap=2.0 if shrink else None)
+        return img.convert("RGBA")
+
+
+def _bayer_matrix(n: int):
+    """Return an n x n Bayer threshold matrix scaled to [-0.5, 0.5)."""
+    m = np.zeros((1, 1), dtype=np.float32)
+    while m.shape[0] < n:
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+    return (m + 0.5) / m.size - 0.5
+
+
+def _bayer_jitter(rgb: Image.Image, size: int, num_colors: int) -> Image.Image:
+    """Offset ``rgb`` by a tiled Bayer matrix, ready for a plain palette mapping."""
+    arr = np.asarray(rgb, dtype=np.float32)
+    h, w = arr.shape[:2]
+    threshold = np.tile(_bayer_matrix(size), (h // size + 1, w // size + 1))[:h, :w]
+    # Roughly the spacing between palette entries along each channel
+    spread = 255.0 / max(1.0, round(num_colors ** (1 / 3)))
+    arr += threshold[:, :, None] * spread
+    return Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8), "RGB")
+
+
+def _split_alpha(img: Image.Image) -> tuple[Image.Image, Image.Image | None]:
+    """Return the RGB part of ``img`` and a mask of its transparent pixels (or None)."""
+    mask = None
+    if img.mode == "RGBA":
+        alpha = img.getchannel("A")
+        if alpha.getextrema()[0] < 128:
+            mask = alpha.point(_ALPHA_CUTOFF)
+    return img.convert("RGB"), mask
+
+
+def _mark_transparent(out: Image.Image, index: int, mask: Image.Image,
+                      palette: list[int] | None = None):
+    """Append a transparent slot at ``index`` and paint the masked pixels with it."""
+    if palette is None:
+        pal = out.getpalette()[:index * 3]
+        palette = pal + [0] * (index * 3 - len(pal)) + [0, 0, 0]
+    out.putpalette(palette)
+    out.paste(index, mask=mask)
+    out.info["transparency"] = index
+
+
+def quantize_frame(img: Image.Image, num_colors: int,
+                   dither_method: str = "NONE") -> Image.Image:
+    """Reduce a frame to P mode in a single palette pass.
+
+    The palette is computed once and the selected dither is applied against
+    that same palette, so the result can go straight to the GIF writer with
+    no further conversion. If the frame has transparent pixels, one palette
+    slot is reserved for them and recorded in ``info["transparency"]``.
+    """
+    num_colors = max(1, min(256, num_colors))
+    with span("quantize"):
+        rgb, mask = _split_alpha(img)
+        colors = num_colors - 1 if mask is not None and num_colors > 1 else num_colors
+        out = rgb.quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+
+    # quantize() ignores ``dither`` when it builds the palette itself, so a
+    # dithered result needs a second mapping pass against that palette.
+    bayer = _BAYER_SIZE.get(dither_method)
+    if bayer and HAS_NUMPY:
+        with span("dither"):
+            out = _bayer_jitter(rgb, bayer, colors).quantize(palette=out, dither=Image.Dither.NONE)
+    elif dither_method != "NONE":
+        with span("dither"):
+            out = rgb.quantize(palette=out, dither=Image.Dither.FLOYDSTEINBERG)
+
+    if mask is not None:
+        _mark_transparent(out, colors, mask)  # colors <= 255, so the slot is free
+    return out
+
+
+def _build_palette_lut(palette: list[int]):
+    """Map every 15-bit RGB value to its nearest palette index."""
+    pal = np.asarray(palette, dtype=np.int32).reshape(-1, 3)
+    levels = np.arange(32, dtype=np.int32) * 8 + 4  # centre of each 5-bit bin
+    grid = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"), -1).reshape(-1, 3)
+    lut = np.empty(len(grid), dtype=np.uint8)
+    for start in range(0, len(grid), 4096):
+        dist = ((grid[start:start + 4096, None, :] - pal[None, :, :]) ** 2).sum(axis=-1)
+        lut[start:start + 4096] = dist.argmin(axis=1)
+    return lut
+
+
+class GlobalPalette:
+    """One palette shared by every frame of an animation.
+
+    Built once from a strided pixel sample across the source frames and
+    written as the GIF global color table, so frames carry no local palette
+    and colors cannot flicker between frames. Undithered frames are mapped
+    through a precomputed RGB -> index lookup table instead of quantized.
+    """
+
+    SAMPLE_FRAMES = 32   # frames sampled across the sequence
+    SAMPLE_SIDE = 128    # longest side of each sampled frame
+
+    def __init__(self, palette: list[int], transparency: int | None = None):
+        self.colors = len(palette) // 3
+        self.transparency = transparency
+        # Carrier image for Pillow's quantize(palette=...); holds only real
+        # colors so nothing can map onto the transparent slot.
+        self.image = Image.new("P", (1, 1))
+        self.image.putpalette(palette)
+        self.palette = palette + ([0, 0, 0] if transparency is not None else [])
+        self._lut = _build_palette_lut(palette) if HAS_NUMPY else None
+
+    @classmethod
+    def from_files(cls, paths: list[str], num_colors: int,
+                   cancel: threading.Event | None = None) -> "GlobalPalette":
+        """Build a palette from an evenly strided sample of ``paths``."""
+        num_colors = max(1, min(256, num_colors))
+        step = max(1, len(paths) // cls.SAMPLE_FRAMES)
+        samples = []
+        has_alpha = False
+        for path in _until_cancelled(paths[::step][:cls.SAMPLE_FRAMES], cancel):
+            with Image.open(path) as src:
+                src.draft("RGB", (cls.SAMPLE_SIDE, cls.SAMPLE_SIDE))
+                img = src.convert("RGBA")
+            img.thumbnail((cls.SAMPLE_SIDE, cls.SAMPLE_SIDE), Image.NEAREST)
+            rgb, mask = _split_alpha(img)
+            has_alpha = has_alpha or mask is not None
+            samples.append(rgb)
+        if not samples:
+            raise RuntimeError("No frames to build a palette from.")
+
+        mosaic = Image.new("RGB", (max(im.width for im in samples),
+                                   sum(im.height for im in samples)))
+        y = 0
+        for im in samples:
+            mosaic.paste(im, (0, y))
+            # Fill the row's right margin so the padding adds no black
+            if im.width < mosaic.width:
+                mosaic.paste(im.resize((mosaic.width - im.width, im.height)), (im.width, y))
+            y += im.height
+
+        colors = num_colors - 1 if has_alpha and num_colors > 1 else num_colors
+        quantized = mosaic.quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+        palette = quantized.getpalette()[:colors * 3]
+        palette += [0] * (colors * 3 - len(palette))
+        return cls(palette, transparency=colors if has_alpha else None)
+
+    def apply(self, img: Image.Image, dither_method: str = "NONE") -> Image.Image:
+        """Map a frame onto the shared palette, returning a P-mode frame."""
+        rgb, mask = _split_alpha(img)
+        bayer = _BAYER_SIZE.get(dither_method)
+        if bayer and HAS_NUMPY:
+            with span("dither"):
+                rgb = _bayer_jitter(rgb, bayer, self.colors)
+        if self._lut is not None and (bayer or dither_method == "NONE"):
+            with span("quantize"):
+                a = np.asarray(rgb) >> 3
+                key = (a[..., 0].astype(np.uint16) << 10) | (a[..., 1].astype(np.uint16) << 5) | a[..., 2]
+                out = Image.fromarray(self._lut[key], "P")
+        else:
+            dither = Image.Dither.NONE if dither_method == "NONE" else Image.Dither.FLOYDSTEINBERG
+            with span("quantize" if dither_method == "NONE" else "dither"):
+                out = rgb.quantize(palette=self.image, dither=dither)
+        out.putpalette(self.palette)
+        if mask is not None and self.transparency is not None:
+            _mark_transparent(out, self.transparency, mask, self.palette)
+        return out
+
+
+def iter_dissolve(frames, steps: int, deferred: bool = False):
+    """Yield ``steps`` cross-fade frames between each consecutive pair.
+
+    The first blend of each pair is the source frame itself and the final
+    source frame is yielded once at the end. Blends are produced on demand,
+    so only the two neighbouring frames are resident however many steps are
+    requested.
+
+    With ``deferred=True`` blends are yielded as zero-argument callables
+    instead of images, so a worker pool (see ``materialize``) can compute
+    them in parallel while the generator itself stays cheap.
+    """
+    prev = None
+    for img in frames:
+        if prev is not None:
+            yield prev
+            for j in range(1, steps):
+                blend = partial(Image.blend, prev, img, j / steps)
+                yield blend if deferred else blend()
+        prev = img
+    if prev is not None:
+        yield prev
+
+
+def materialize(frame) -> Image.Image:
+    """Return ``frame``, evaluating it first if it is a deferred blend."""
+    if not callable(frame):
+        return frame
+    with span("dissolve"):
+        return frame()
+
+
+def _to_gif_frame(img: Image.Image) -> Image.Image:
+    """Return ``img`` in a mode the GIF encoder can write (P or L)."""
+    if img.mode in ("P", "L"):
+        return img
+    im = img.convert("P", palette=Image.Palette.ADAPTIVE)
+    if im.palette.mode == "RGBA":
+        for rgba, index in im.palette.colors.items():
+            if rgba[3] == 0:
+                im.info["transparency"] = index
+                break
+    return im
+
+
+def _same_frame(a: Image.Image, b: Image.Image) -> bool:
+    return (a.size == b.size and a.mode == b.mode
+            and a.getpalette() == b.getpalette() and a.tobytes() == b.tobytes())
+
+
+def _is_transparent(frame: Image.Image) -> bool:
+    """True if some pixel of ``frame`` actually uses its transparent index."""
+    index = frame.info.get("transparency")
+    return (frame.mode == "P" and isinstance(index, int)
+            and frame.histogram()[index] > 0)
+
+
+# Maps a per-pixel difference to a paste mask of unchanged pixels
+_UNCHANGED_LUT = [255] + [0] * 255
+_IDENTITY_PALETTE = [v for v in range(256) for _ in range(3)]
+
+
+def _unused_index(img: Image.Image) -> int | None:
+    """A palette index no pixel of ``img`` uses, or None if all 256 are."""
+    counts = img.histogram()
+    return counts.index(0) if 0 in counts else None
+
+
+def _unchanged_mask(diff: Image.Image) -> Image.Image:
+    """L mask that is 255 where ``diff`` (an RGB or index difference) is zero."""
+    if diff.mode == "P":
+        # Index differences: read the raw values back through a gray ramp
+        diff.putpalette(_IDENTITY_PALETTE)
+        return diff.convert("L").point(_UNCHANGED_LUT)
+    r, g, b = diff.split()
+    return ImageChops.lighter(ImageChops.lighter(r, g), b).point(_UNCHANGED_LUT)
+
+
+def _encode_gif_frame(frame: Image.Image, offset: tuple[int, int], params: dict) -> bytes:
+    """LZW-compress one frame into its complete GIF image block."""
+    return b"".join(GifImagePlugin.getdata(frame, offset, **params))
+
+
+def _encode_gif_frame_timed(frame: Image.Image, offset: tuple[int, int], params: dict):
+    """``_encode_gif_frame`` for worker processes: also returns its own timing."""
+    start, cpu = time.perf_counter(), time.thread_time()
+    block = _encode_gif_frame(frame, offset, params)
+    return block, start, time.perf_counter() - start, time.thread_time() - cpu, os.getpid()
+
+
+class GifStreamWriter:
+    """Write an animated GIF one frame at a time.
+
+    Pillow's ``save_all`` holds every frame until the file is written; this
+    writer emits each frame's header and LZW data as soon as it is added, so
+    memory does not grow with frame count. Consecutive identical frames are
+    merged into one longer frame, as Pillow does, and frames that share the
+    first frame's palette are written without a local color table.
+
+    With ``delta=True`` each opaque frame is cropped to the rectangle that
+    differs from what is already on screen, and pixels inside it that did
+    not change are set to a transparent index, so static regions cost next
+    to nothing. Frames with real transparency (and the frame before them)
+    are written whole with "restore to background" disposal instead, since
+    they must not show the previous frame through.
+
+    Every GIF frame is an independent LZW stream, so with ``workers`` > 1
+    frames are compressed in a process pool (Pillow's encoder holds the
+    GIL) and the finished blocks are written back in order.
+    """
+
+    def __init__(self, path: str, loop: int = 0, delta: bool = False, workers: int = 1):
+        self.path = path
+        self.loop = loop
+        self.delta = delta
+        self.frames_written = 0
+        self._pending: tuple[Image.Image, int, bool] | None = None
+        self._global_palette: list[int] | None = None
+        self._canvas: Image.Image | None = None  # opaque frame now on screen
+        self._canvas_rgb: Image.Image | None = None
+        self._pool = ProcessPoolExecutor(workers) if workers > 1 else None
+        self._max_in_flight = 2 * workers
+        self._in_flight: deque = deque()  # encoded blocks not yet written, in order
+        self._fp = open(path, "wb")
+
+    def add_frame(self, img: Image.Image, duration: int):
+        frame = _to_gif_frame(img)
+        transparent = self.delta and _is_transparent(frame)
+        if self._pending is not None:
+            prev, prev_duration, prev_transparent = self._pending
+            if _same_frame(prev, frame):
+                self._pending = (prev, prev_duration + duration, prev_transparent)
+                return
+            self._write_frame(prev, prev_duration, prev_transparent, transparent)
+        self._pending = (frame, duration, transparent)
+
+    def close(self):
+        """Flush the last frame and write the trailer."""
+        if self._fp is None:
+            return
+        try:
+            if self._pending is not None:
+                self._write_frame(*self._pending, next_transparent=False)
+                self._pending = None
+            if self.frames_written == 0:
+                raise RuntimeError("No frames to encode.")
+            self._drain(0)
+            self._write(b";")
+        finally:
+            self._shutdown()
+
+    def _write_frame(self, frame: Image.Image, duration: int,
+                     transparent: bool = False, next_transparent: bool = False):
+        params = {"duration": duration}
+        if "transparency" in frame.info:
+            params["transparency"] = frame.info["transparency"]
+        offset = (0, 0)
+        if self.delta:
+            with span("encode"):
+                frame, offset = self._delta_frame(frame, params,
+                                                  clear=transparent or next_transparent)
+        if self.frames_written == 0:
+            # The first frame's palette becomes the global color table
+            header, _ = GifImagePlugin.getheader(
+                frame, info={"loop": self.loop, "duration": duration})
+            self._write(b"".join(header))
+            self._global_palette = frame.getpalette()
+        elif frame.getpalette() != self._global_palette:
+            params["include_color_table"] = True
+        if self._pool is None:
+            with span("encode"):
+                block = _encode_gif_frame(frame, offset, params)
+            self._write(block)
+        else:
+            self._in_flight.append(
+                self._pool.submit(_encode_gif_frame_timed, frame, offset, params))
+            self._drain(self._max_in_flight)
+        self.frames_written += 1
+
+    def _drain(self, keep: int):
+        """Write finished blocks, oldest first, until at most ``keep`` are pending."""
+        trace = _current_trace.get()
+        while len(self._in_flight) > keep:
+            block, start, seconds, cpu, pid = self._in_flight.popleft().result()
+            if trace is not None:
+                trace.add("encode", start, seconds, cpu, pid=pid, tid=pid)
+            self._write(block)
+
+    def _write(self, data: bytes):
+        with span("write"):
+            self._fp.write(data)
+        _count_bytes("write", len(data))
+
+    def _shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        self._in_flight.clear()
+        self._fp.close()
+        self._fp = None
+
+    def _delta_frame(self, frame: Image.Image, params: dict, clear: bool):
+        """Reduce ``frame`` to its changes against the canvas; returns (frame, offset)."""
+        if frame.mode != "P":
+            params["disposal"] = 2
+            self._canvas = None
+            return frame, (0, 0)
+        index = frame.info.get("transparency")
+        if not isinstance(index, int):
+            index = None
+            size = len(frame.getpalette()) // 3
+            if size < 256:
+                # Spare slot past the palette's end (added to every frame, so a
+                # shared palette still matches the global color table)
+                frame = frame.copy()
+                frame.putpalette(frame.getpalette() + [0, 0, 0])
+                index = size
+        if clear:
+            # Written whole, then cleared so the next frame starts from nothing.
+            # A transparent index makes decoders clear to transparent rather
+            # than to a background color.
+            if index is None:
+                index = _unused_index(frame)
+            if index is not None:
+                params["transparency"] = index
+            params["disposal"] = 2
+            self._canvas = None
+            return frame, (0, 0)
+        params["disposal"] = 1  # leave in place: later frames draw on top
+        canvas, canvas_rgb = self._canvas, self._canvas_rgb
+        self._canvas, self._canvas_rgb = frame, None
+        if canvas is None or canvas.size != frame.size:
+            return frame, (0, 0)
+        if canvas.getpalette() == frame.getpalette():
+            diff = ImageChops.difference(frame, canvas)  # same palette: compare indices
+        else:
+            self._canvas_rgb = frame.convert("RGB")
+            diff = ImageChops.difference(self._canvas_rgb,
+                                         canvas_rgb or canvas.convert("RGB"))
+        # Nothing changed (but the palette did): keep one see-through pixel
+        bbox = diff.getbbox() or (0, 0, 1, 1)
+        patch = frame.crop(bbox)
+        if index is None:
+            index = _unused_index(patch)  # only needs to be free inside the patch
+        if index is not None:
+            patch.paste(index, mask=_unchanged_mask(diff.crop(bbox)))
+            params["transparency"] = index
+        return patch, bbox[:2]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._fp is not None:
+            self._shutdown()
+
+
+# ---------------------------------------------------------------------------
+# Processed-frame cache
+# ---------------------------------------------------------------------------
+class FrameCache:
+    """On-disk, content-addressed cache of processed frames.
+
+    Entries are keyed by the SHA-256 of the source file plus the processing
+    parameters, so changing only TIME IT or NAME IT re-uses every frame. The
+    file hash is only recomputed when a file's size or mtime changes; those
+    fingerprints are kept in one small JSON file per source folder. Frames
+    are stored as a small header plus raw pixel bytes (one byte per pixel
+    for palette frames) and evicted least-recently-used once the cache
+    grows past ``max_bytes``; fingerprints go with the last of a folder's
+    frames. Safe to share between threads; separate processes may share
+    the directory too, since every write is an atomic rename and a
+    fingerprint file is merged with what is on disk before it is replaced.
+    """
+
+    MAGIC = b"GIFC1"
+    _HEADER = struct.Struct("<5s4sIIHh")  # magic, mode, width, height, palette len, transparency
+    PALETTE_FRAME_OVERHEAD = _HEADER.size + 768  # plus one byte per pixel
+
+    def __init__(self, root: str | os.PathLike = CACHE_DIR, max_bytes: int = 2 << 30):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._frames_dir = self.root / "frames"
+        self._frames_dir.mkdir(parents=True, exist_ok=True)
+        self._sources_dir = self.root / "sources"
+        self._sources_dir.mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+        self._hashes: dict[str, dict[str, list]] = {}  # folder -> name -> [size, mtime, digest]
+        self._dirty: dict[str, set] = {}  # folder -> names hashed since the last flush
+        self._total_bytes: int | None = None
+
+    # -- source fingerprints --
+    def _source_file(self, folder: str) -> Path:
+        return self._sources_dir / (hashlib.sha256(folder.encode()).hexdigest()[:32] + ".json")
+
+    def _load_source(self, folder: str) -> dict:
+        try:
+            with open(self._source_file(folder), "r") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        if not isinstance(data, dict) or data.get("folder") != folder:
+            return {}
+        return data.get("files", {})
+
+    def source_digest(self, path: str) -> str:
+        """SHA-256 of ``path``'s contents, skipping the read if size and mtime match."""
+        st = os.stat(path)
+        folder, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            if folder not in self._hashes:
+                self._hashes[folder] = self._load_source(folder)
+            known = self._hashes[folder].get(name)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            return known[2]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._hashes[folder][name] = [st.st_size, st.st_mtime_ns, digest]
+            self._dirty.setdefault(folder, set()).add(name)
+        return digest
+
+    def flush(self):
+        """Persist the source fingerprints gathered so far.
+
+        Each folder's file is re-read and merged first, so another process
+        flushing the same folder keeps its entries, and fingerprints of
+        files that no longer exist are dropped.
+        """
+        with self._lock:
+            folders = list(self._hashes)
+            dirty, self._dirty = self._dirty, {}
+        for folder in folders:
+            target = self._source_file(folder)
+            with self._lock:
+                names = dirty.get(folder)
+            if names is None:
+                try:
+                    os.utime(target)  # still in use: see _evict
+                    continue
+                except OSError:
+                    pass  # pruned by _evict meanwhile: write everything we know
+            with self._lock:
+                known = self._hashes[folder]
+                ours = {name: known[name] for name in (names or known)}
+            merged = self._load_source(folder)
+            merged.update(ours)
+            merged = {name: entry for name, entry in merged.items()
+                      if os.path.exists(os.path.join(folder, name))}
+            tmp = target.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                tmp.write_text(json.dumps({"folder": folder, "files": merged}))
+                os.replace(tmp, target)
+            except OSError:
+                continue  # fingerprints are only a speed-up
+            with self._lock:
+                self._hashes[folder] = merged
+
+    def fits(self, frames: int, frame_size: tuple[int, int]) -> bool:
+        """Whether ``frames`` palette frames of ``frame_size`` fit after an eviction.
+
+        A job that does not fit would evict its own frames before reading
+        them back, in the same order: every lookup of the next run misses.
+        """
+        w, h = frame_size
+        return frames * (w * h + self.PALETTE_FRAME_OVERHEAD) <= self.max_bytes * 9 // 10
+
+    # -- entries --
+    def key(self, path: str, params: tuple) -> str:
+        return hashlib.sha256(
+            (self.source_digest(path) + repr(params)).encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self._frames_dir / key[:2] / key
+
+    def get(self, key: str) -> Image.Image | None:
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # mark as recently used
+        except OSError:
+            return None
+        try:
+            magic, mode, w, h, pal_len, transparency = self._HEADER.unpack_from(data)
+            if magic != self.MAGIC:
+                return None
+            offset = self._HEADER.size
+            mode = mode.rstrip(b"\0").decode()
+            palette = data[offset:offset + pal_len]
+            img = Image.frombytes(mode, (w, h), data[offset + pal_len:])
+        except (struct.error, ValueError):
+            return None  # truncated or foreign file: treat as a miss
+        if palette:
+            img.putpalette(palette)
+        if transparency >= 0:
+            img.info["transparency"] = transparency
+        return img
+
+    def put(self, key: str, img: Image.Image):
+        palette = bytes(img.getpalette() or b"") if img.mode == "P" else b""
+        transparency = img.info.get("transparency", -1)
+        if not isinstance(transparency, int):
+            transparency = -1
+        pixels = img.tobytes()
+        size = self._HEADER.size + len(palette) + len(pixels)
+        if size > self.max_bytes // 8:
+            return  # one frame would push out too much of the cache
+        path = self._entry_path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(self._HEADER.pack(self.MAGIC, img.mode.encode(), img.width,
+                                      img.height, len(palette), transparency))
+            f.write(palette)
+            f.write(pixels)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            self._total_bytes += size
+            over = self._total_bytes > self.max_bytes
+        if over:
+            self._evict()
+
+    def _scan_size(self) -> int:
+        return sum(p.stat().st_size for p in self._frames_dir.glob("*/*"))
+
+    def _evict(self):
+        """Delete least-recently-used entries until the cache is at 90% of its budget."""
+        entries = []
+        for p in self._frames_dir.glob("*/*"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        entries.sort()
+        total = sum(e[1] for e in entries)
+        target = self.max_bytes * 9 // 10
+        oldest = None  # last use of the least recently used frame kept
+        for mtime, size, p in entries:
+            if total <= target:
+                oldest = mtime
+                break
+            try:
+                p.unlink()
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._total_bytes = total
+        # A folder's fingerprints are rewritten or touched after its frames
+        # were last used; if that is older than every frame left, none of
+        # its frames are.
+        for p in self._sources_dir.glob("*.json"):
+            try:
+                if oldest is None or p.stat().st_mtime < oldest:
+                    p.unlink()
+            except OSError:
+                pass
+
+    def wrap(self, func, params: tuple, store: bool = True):
+        """Return ``func(path)`` memoized through the cache under ``params``.
+
+        With ``store`` False, cached frames are still used but new ones are
+        not written.
+        """
+        def cached(path: str) -> Image.Image:
+            key = self.key(path, params)
+            img = self.get(key)
+            if img is None:
+                img = func(path)
+                if store:
+                    self.put(key, img)
+            return img
+        return cached
+
+
+# ---------------------------------------------------------------------------
+# Folder index
+# ---------------------------------------------------------------------------
+# Bits per pixel for modes that are not 8 bits per band
+_MODE_BITS = {"1": 1, "I": 32, "F": 32, "I;16": 16, "I;16L": 16, "I;16B": 16, "I;16N": 16}
+
+
+@dataclass
+class FrameInfo:
+    """What an image's header says about it."""
+    name: str
+    width: int = 0
+    height: int = 0
+    mode: str = ""
+    bits: int = 0          # per pixel
+    frames: int = 1        # > 1 for animated sources
+    error: str | None = None  # set when the header could not be read
+
+    @classmethod
+    def read(cls, folder: str, name: str) -> "FrameInfo":
+        """Read ``name``'s header; nothing is decoded."""
+        try:
+            with Image.open(os.path.join(folder, name)) as img:
+                bits = _MODE_BITS.get(img.mode, 8 * len(img.getbands()))
+                return cls(name, img.width, img.height, img.mode, bits,
+                           getattr(img, "n_frames", 1))
+        except Exception as e:
+            return cls(name, error=str(e) or type(e).__name__)
+
+
+class FolderIndex:
+    """Header metadata for the images in one folder, kept between sessions.
+
+    ``scan`` reads the headers of new or changed files in parallel and
+    re-uses everything else from a small JSON file in ``INDEX_DIR``, keyed
+    by each file's size and mtime, so re-opening a large folder costs one
+    directory listing.
+    """
+
+    VERSION = 1
+
+    def __init__(self, folder: str, root: str | os.PathLike = INDEX_DIR):
+        self.folder = os.path.abspath(folder)
+        digest = hashlib.sha256(self.folder.encode(errors="surrogatepass")).hexdigest()
+        self.path = Path(root) / f"{digest[:24]}.json"
+        self.read_count = 0  # headers read by the last scan
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        if data.get("version") != self.VERSION or data.get("folder") != self.folder:
+            return {}
+        return data.get("frames", {})
+
+    def _save(self, entries: dict):
+        data = {"version": self.VERSION, "folder": self.folder, "frames": entries}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_text(json.dumps(data, separators=(",", ":")))
+            os.replace(tmp, self.path)
+        except OSError:
+            pass  # the index is only a speed-up
+
+    def scan(self, files: list[str] | None = None, workers: int = 0,
+             cancel: threading.Event | None = None) -> list[FrameInfo]:
+        """Return a FrameInfo for each of ``files`` (default: every image), in order.
+
+        Setting ``cancel`` stops reading headers (raising RenderCancelled);
+        the ones already read are still saved.
+        """
+        stamps = {}
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    st = entry.stat()
+                    stamps[entry.name] = [st.st_size, st.st_mtime_ns]
+        if files is None:
+            files = sorted(stamps, key=natural_key)
+        stored = self._load()
+        entries, infos, stale = {}, {}, []
+        for name in dict.fromkeys(files):
+            stamp = stamps.get(name)
+            if stamp is None:
+                # Not listed under an image extension (e.g. added via "All files")
+                try:
+                    st = os.stat(os.path.join(self.folder, name))
+                except OSError:
+                    infos[name] = FrameInfo(name, error="file not found")
+                    continue
+                stamp = stamps[name] = [st.st_size, st.st_mtime_ns]
+            known = stored.get(name)
+            if known is not None and known[:2] == stamp:
+                entries[name] = known
+                infos[name] = FrameInfo(name, *known[2:])
+            else:
+                stale.append(name)
+        self.read_count = 0
+        try:
+            for info in _until_cancelled(ordered_map(partial(FrameInfo.read, self.folder),
+                                                     stale, resolve_workers(workers)), cancel):
+                infos[info.name] = info
+                self.read_count += 1
+                if info.error is None:
+                    entries[info.name] = stamps[info.name] + [
+                        info.width, info.height, info.mode, info.bits, info.frames]
+        finally:
+            # Entries for files outside this scan are kept while they are current
+            merged = {n: e for n, e in stored.items() if stamps.get(n) == e[:2]}
+            merged.update(entries)
+            if merged != stored:
+                self._save(merged)
+        return [infos[name] for name in files]
+
+
+@dataclass
+class FrameCheck:
+    """Problems found in a frame list before rendering it."""
+    errors: list[str]    # the render would fail
+    warnings: list[str]  # the render works, but may not look as expected
+
+
+def check_frames(infos: list[FrameInfo], spec: "RenderSpec") -> FrameCheck:
+    """Look for unreadable, mismatched, animated or high-bit-depth frames,
+    and for gaps or repeats in the frame numbering."""
+    errors, warnings = [], []
+    numbering = check_numbering([i.name for i in infos])
+    if numbering:
+        warnings.append(numbering.describe())
+    bad = [i for i in infos if i.error]
+    if bad:
+        errors.append(f"{len(bad)} file(s) can't be read, e.g. {bad[0].name}: {bad[0].error}")
+    good = [i for i in infos if not i.error]
+    if not good:
+        return FrameCheck(errors, warnings)
+
+    first = good[0]
+    odd = [i for i in good if (i.width, i.height) != (first.width, first.height)]
+    if odd:
+        text = (f"{len(odd)} of {len(good)} frames are not {first.width}x{first.height} "
+                f"like {first.name}, e.g. {odd[0].name} is {odd[0].width}x{odd[0].height}")
+        if spec.dissolve > 0:
+            errors.append(text + "; DISSOLVE IT needs all frames the same size")
+        elif spec.fmt == "MP4":
+            warnings.append(text + "; they will be resized to match")
+        else:
+            warnings.append(text + "; larger frames will be cut off")
+    animated = [i for i in good if i.frames > 1]
+    if animated:
+        warnings.append(f"{len(animated)} file(s) are animated, e.g. {animated[0].name} "
+                        f"({animated[0].frames} frames); only the first frame is used")
+    deep = [i for i in good if i.mode in _MODE_BITS and i.bits > 8]
+    if deep:
+        warnings.append(f"{len(deep)} frame(s) are {deep[0].bits}-bit {deep[0].mode}, "
+                        f"e.g. {deep[0].name}; values above 255 are clipped")
+    return FrameCheck(errors, warnings)
+
+
+# ---------------------------------------------------------------------------
+# Memory budget
+# ---------------------------------------------------------------------------
+def _physical_memory() -> int | None:
+    """Total RAM in bytes, or None if it cannot be determined."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        pass
+    if sys.platform == "win32":
+        import ctypes
+
+        class _MemoryStatus(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong)]
+            _fields_ += [(name, ctypes.c_ulonglong) for name in (
+                "ullTotalPhys", "ullAvailPhys", "ullTotalPageFile", "ullAvailPageFile",
+                "ullTotalVirtual", "ullAvailVirtual", "ullAvailExtendedVirtual")]
+
+        status = _MemoryStatus(dwLength=ctypes.sizeof(_MemoryStatus))
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullTotalPhys
+    return None
+
+
+def memory_budget(mb: int) -> int | None:
+    """Bytes a render may use: ``mb`` MiB, or half the RAM when ``mb`` is 0.
+
+    Returns None (no limit) for a negative ``mb``, or for 0 when the RAM
+    size is unknown.
+    """
+    if mb > 0:
+        return mb << 20
+    if mb < 0:
+        return None
+    total = _physical_memory()
+    return total // 2 if total else None
+
+
+@dataclass
+class MemoryEstimate:
+    """Pre-flight estimate of a render's peak memory, and the plan to fit it.
+
+    Sizes come from image headers, so nothing is decoded. ``needed_bytes``
+    is what the render would use as requested; ``peak_bytes`` what it is
+    expected to use with the planned ``workers`` and ``spill`` setting.
+    """
+    source_size: tuple[int, int]   # largest source frame
+    frame_size: tuple[int, int]    # largest output frame
+    workers: int
+    needed_bytes: int
+    peak_bytes: int
+    budget_bytes: int | None
+    spill: bool = False            # queued frames are kept in a memory-mapped store
+
+    @property
+    def over_budget(self) -> bool:
+        return self.budget_bytes is not None and self.peak_bytes > self.budget_bytes
+
+    def describe(self) -> str:
+        """One line for a status bar or log."""
+        w, h = self.frame_size
+        text = f"~{_format_bytes(self.needed_bytes)} for {w}x{h} frames"
+        if self.budget_bytes is None:
+            return text
+        text += f" (budget {_format_bytes(self.budget_bytes)})"
+        if self.spill:
+            text += f"; spilling frames to disk, {self.workers} workers"
+        elif self.peak_bytes < self.needed_bytes:
+            text += f"; {self.workers} workers"
+        if self.over_budget:
+            text += f"; may still use ~{_format_bytes(self.peak_bytes)}"
+        return text
+
+
+def _format_bytes(n: int) -> str:
+    return f"{n / (1 << 30):.1f} GB" if n >= 1 << 30 else f"{max(1, n >> 20)} MB"
+
+
+def _frame_costs(spec: "RenderSpec", source_px: int, frame_px: int) -> tuple[int, int, int]:
+    """Bytes per worker for (frame being processed, frames queued, fixed overhead).
+
+    Mirrors ``_frame_stream`` and ``write_output``: each worker decodes a
+    source to RGBA and resizes it, and each pipeline stage keeps up to two
+    finished frames per worker queued for the next. The encoder holds a
+    few frames of its own.
+    """
+    quantized = spec.fmt == "GIF" or spec.colors < 256
+    working = source_px * 8 + frame_px * 8            # decode + convert, resize + convert
+    if quantized:
+        working += frame_px * (20 if spec.dither in _BAYER_SIZE else 4)  # float32 jitter
+    if spec.dissolve > 0:
+        working += frame_px * 4                        # the blend
+    fused = spec.dissolve == 0 and quantized
+    queued = 2 * frame_px * (1 if fused else 4)
+    if not fused and (quantized or spec.dissolve > 0):
+        queued += 2 * frame_px * (1 if quantized else 4)
+    if spec.fmt == "GIF":
+        queued += 2 * frame_px * 2                     # frames sent to encoder processes
+        fixed = frame_px * 6                           # pending frame, canvas, canvas RGB
+    else:
+        fixed = frame_px * (4 + 3 * _END_MARK_FRAMES)  # RGB copy, held-back RGB bytes
+    if spec.dissolve > 0:
+        fixed += frame_px * 8                          # the two frames being blended
+    return working, queued, fixed
+
+
+def plan_memory(spec: "RenderSpec", files: list[str],
+                sizes: list[tuple[int, int]] | None = None,
+                cancel: threading.Event | None = None) -> MemoryEstimate:
+    """Estimate a render's memory and fit it to ``spec.memory_budget_mb``.
+
+    If the job as requested is over budget, queued frames are spilled to a
+    memory-mapped store first (keeping every worker busy), then workers
+    are dropped until the frames being processed fit. A job that cannot
+    fit even on one worker still runs, spilled, and reports ``over_budget``.
+    Frame sizes come from the folder index unless ``sizes`` is given.
+    """
+    workers = resolve_workers(spec.workers)
+    if sizes is None:
+        infos = FolderIndex(spec.folder).scan(files, workers, cancel)
+        sizes = [(i.width, i.height) for i in infos]
+    source = max(sizes, key=lambda wh: wh[0] * wh[1], default=(1, 1))
+    frame = (max(1, int(source[0] * spec.scale)), max(1, int(source[1] * spec.scale)))
+    working, queued, fixed = _frame_costs(spec, source[0] * source[1], frame[0] * frame[1])
+    needed = workers * (working + queued) + fixed
+    budget = memory_budget(spec.memory_budget_mb)
+    estimate = MemoryEstimate(source, frame, workers, needed, needed, budget)
+    if budget is None or needed <= budget:
+        return estimate
+    if not HAS_NUMPY:
+        # No memmap store: only fewer workers can help
+        fit = max(1, min(workers, (budget - fixed) // (working + queued)))
+        estimate.workers = fit
+        estimate.peak_bytes = fit * (working + queued) + fixed
+        return estimate
+    fit = max(1, min(workers, (budget - fixed) // working))
+    estimate.workers = fit
+    estimate.peak_bytes = fit * working + fixed
+    estimate.spill = True
+    return estimate
+
+
+# Frame modes Image.frombuffer can map without copying
+_SPILL_MODES = ("L", "P", "RGBA", "RGBX")
+
+
+class SpillStore:
+    """Disk-backed home for processed frames that do not fit the memory budget.
+
+    ``put`` copies a frame into a slot of a memory-mapped temporary file
+    and returns an image that reads straight from the mapping. Its pages
+    are file-backed, so under memory pressure the OS writes them out
+    instead of swapping the process or killing it. A slot is reused once
+    the image using it has been garbage-collected; the files are deleted
+    when the store is.
+    """
+
+    def __init__(self, root: str | os.PathLike = SPILL_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.slots = 0      # slots created
+        self.frames = 0     # frames spilled
+        self._free: list = []
+        self._lock = threading.Lock()
+
+    def put(self, img: Image.Image) -> Image.Image:
+        if img.mode not in _SPILL_MODES:
+            return img
+        arr = np.asarray(img).reshape(-1)
+        slot = self._take(arr.nbytes)
+        slot[:arr.nbytes] = arr
+        out = Image.frombuffer(img.mode, img.size, slot[:arr.nbytes], "raw", img.mode, 0, 1)
+        if img.mode == "P":
+            out.putpalette(img.getpalette())
+        out.info.update(img.info)
+        weakref.finalize(out, self._release, slot)
+        with self._lock:
+            self.frames += 1
+        return out
+
+    def wrap(self, func):
+        """Return ``func`` with its result moved into the store."""
+        return lambda *args: self.put(func(*args))
+
+    def _take(self, nbytes: int):
+        with self._lock:
+            for i, slot in enumerate(self._free):
+                if slot.size >= nbytes:
+                    return self._free.pop(i)
+            self.slots += 1
+        with tempfile.TemporaryFile(dir=self.root) as f:
+            if hasattr(os, "posix_fallocate"):
+                # Fail now if the disk is full, not with SIGBUS on first write
+                os.posix_fallocate(f.fileno(), 0, nbytes)
+            else:
+                f.truncate(nbytes)
+            return np.memmap(f, dtype=np.uint8, mode="r+", shape=(nbytes,))
+
+    def _release(self, slot):
+        with self._lock:
+            self._free.append(slot)
+
+
+# ---------------------------------------------------------------------------
+# Render API
+# ---------------------------------------------------------------------------
+@dataclass
+class RenderSpec:
+    """Settings for one render; mirrors the GUI controls."""
+    folder: str
+    output_name: str = ""          # NAME IT; blank = folder name
+    speed_ms: int = 100            # TIME IT
+    dissolve: int = 0              # DISSOLVE IT
+    scale: float = 1.0             # SIZE
+    colors: int = 256              # COLORS
+    dither: str = "NONE"           # DITHER
+    fmt: str = "GIF"               # FORMAT
+    global_palette: bool = False
+    workers: int = 0               # 0 = one per CPU core
+    output_folder: str | None = None  # default: parent of ``folder``
+    segments: int = 1              # MP4: encode this many parts in parallel
+    memory_budget_mb: int = 0      # 0 = half the RAM, negative = no limit
+
+    def validate(self):
+        """Raise ValueError for settings no render could satisfy."""
+        if self.speed_ms <= 0:
+            raise ValueError("TIME IT must be a positive number of milliseconds.")
+        if self.dissolve < 0:
+            raise ValueError("DISSOLVE IT cannot be negative.")
+        if self.scale <= 0:
+            raise ValueError("SIZE must be greater than zero.")
+        if not 1 <= self.colors <= 256:
+            raise ValueError("COLORS must be between 1 and 256.")
+        if self.dither not in DITHER_MAP:
+            raise ValueError(f"Unknown dither method: {self.dither}")
+        if self.fmt not in FORMATS:
+            raise ValueError(f"Unknown output format: {self.fmt}")
+        if self.segments < 1:
+            raise ValueError("Segments must be at least 1.")
+
+    def output_path(self) -> str:
+        folder = os.path.normpath(self.folder)
+        name = self.output_name.strip() or os.path.basename(folder)
+        out_dir = self.output_folder or os.path.dirname(folder)
+        return os.path.join(out_dir, name + "." + self.fmt.lower())
+
+
+@dataclass
+class RenderResult:
+    output_path: str
+    frames_in: int
+    frames_out: int
+    output_bytes: int
+    seconds: float
+    up_to_date: bool = False  # True when the render was skipped
+    report: dict | None = None  # per-stage timings, when rendered with a trace
+    memory: MemoryEstimate | None = None  # pre-flight estimate and plan
+    warnings: list[str] | None = None  # from check_frames
+
+
+# Bump whenever the same inputs and settings would encode differently, so
+# outputs written by an older version are rebuilt rather than trusted.
+MANIFEST_VERSION = 2
+
+# Settings that cannot change the output file
+_NON_OUTPUT_FIELDS = ("workers", "output_folder", "memory_budget_mb")
+
+
+def report_paths(output_path: str) -> tuple[str, str]:
+    """Where the render report and Chrome trace for ``output_path`` are written."""
+    return output_path + ".report.json", output_path + ".trace.json"
+
+
+def manifest_path(output_path: str) -> str:
+    """Where the render manifest for ``output_path`` lives."""
+    return output_path + ".manifest.json"
+
+
+def _file_stamp(path: str) -> list:
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def build_manifest(spec: RenderSpec, files: list[str]) -> dict:
+    """Describe everything a render's output depends on.
+
+    Inputs are fingerprinted by size and mtime, like make; the list keeps
+    their order so reordering frames also counts as a change.
+    """
+    settings = asdict(spec)
+    for field in _NON_OUTPUT_FIELDS:
+        settings.pop(field)
+    return {
+        "version": MANIFEST_VERSION,
+        "settings": settings,
+        "frames": [[f, *_file_stamp(os.path.join(spec.folder, f))] for f in files],
+    }
+
+
+def check_up_to_date(spec: RenderSpec, files: list[str]) -> dict | None:
+    """Return the stored manifest if the output needs no rebuild, else None."""
+    path = spec.output_path()
+    try:
+        with open(manifest_path(path), "r") as f:
+            stored = json.load(f)
+        output_stamp = _file_stamp(path)
+    except (OSError, json.JSONDecodeError):
+        return None
+    current = build_manifest(spec, files)
+    if any(stored.get(k) != v for k, v in current.items()):
+        return None
+    # The output itself must be the file this manifest was written for
+    if stored.get("output") != output_stamp:
+        return None
+    return stored
+
+
+def _write_manifest(manifest: dict, path: str, frames_out: int):
+    manifest = dict(manifest, output=_file_stamp(path), frames_out=frames_out)
+    target = manifest_path(path)
+    tmp = target + f".{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, target)
+
+
+_DIGITS = re.compile(r"(\d+)")
+_LAST_NUMBER = re.compile(r"(\d+)(\D*)$")
+
+
+def natural_key(name: str) -> str:
+    """Sort key putting ``frame_2.png`` before ``frame_10.png``, padded or not.
+
+    Digit runs are zero-padded to a fixed width so the key is a plain
+    string: building it is one regex split and comparing it is a C string
+    compare, which sorts 100k names several times faster than tuple keys.
+    Names that only differ in padding or case keep a stable order.
+    """
+    parts = _DIGITS.split(name)
+    if len(parts) > 1:
+        parts[1::2] = [p.zfill(24) for p in parts[1::2]]
+    return "".join(parts).casefold() + "\0" + name
+
+
+def list_frames(folder: str) -> list[str]:
+    """Return the supported image file names in ``folder``, in natural order."""
+    with os.scandir(folder) as it:
+        names = [e.name for e in it
+                 if e.name.lower().endswith(SUPPORTED_EXTENSIONS) and e.is_file()]
+    names.sort(key=natural_key)
+    return names
+
+
+@dataclass
+class Numbering:
+    """Frame-number problems in a list of file names."""
+    gaps: list[tuple[str, int, int]]  # (name prefix, first, last missing number)
+    duplicates: list[list[str]]       # names sharing one frame number
+
+    def __bool__(self) -> bool:
+        return bool(self.gaps or self.duplicates)
+
+    def describe(self, limit: int = 3) -> str:
+        """One line for a status bar, e.g. "Missing frame_13-15, frame_40"."""
+        notes = []
+        if self.gaps:
+            shown = [f"{p}{a}" if a == b else f"{p}{a}-{b}" for p, a, b in self.gaps[:limit]]
+            more = f" (+{len(self.gaps) - limit} more gaps)" if len(self.gaps) > limit else ""
+            notes.append("Missing " + ", ".join(shown) + more)
+        if self.duplicates:
+            notes.append(f"{len(self.duplicates)} frame number(s) used twice, e.g. "
+                         + " / ".join(self.duplicates[0]))
+        return ". ".join(notes)
+
+
+def check_numbering(files: list[str]) -> Numbering:
+    """Find missing and repeated frame numbers in ``files``.
+
+    Names are grouped by what surrounds their last number, ignoring case,
+    so ``a_7.png`` and ``b_7.png`` are separate sequences, while ``f_7.png``,
+    ``F_007.png`` and ``f_7.jpg`` are the same frame. A sequence's step is its most
+    common difference between consecutive numbers (renders numbered 0, 10,
+    20 ... are not full of gaps).
+    """
+    groups: dict[tuple[str, str], list[tuple[int, str]]] = {}
+    search = _LAST_NUMBER.search
+    for name in files:
+        m = search(name)
+        if m is not None:
+            groups.setdefault((name[:m.start()], m[2]), []).append((int(m[1]), name))
+    # What follows the number only counts up to the extension; case never does
+    merged: dict[tuple[str, str], list[tuple[int, str]]] = {}
+    shown: dict[tuple[str, str], str] = {}  # the prefix as first spelled, for gaps
+    for (prefix, tail), entries in groups.items():
+        key = (prefix.casefold(), tail.rsplit(".", 1)[0].casefold())
+        merged.setdefault(key, []).extend(entries)
+        shown.setdefault(key, prefix)
+
+    gaps, duplicates = [], []
+    for key, entries in merged.items():
+        prefix = shown[key]
+        entries.sort()  # near-linear: names usually arrive in natural order
+        numbers = [entries[0][0]]
+        for (a, name_a), (b, name_b) in zip(entries, entries[1:]):
+            if a != b:
+                numbers.append(b)
+            elif name_a == name_b:
+                continue  # the same file listed twice is deliberate
+            elif duplicates and duplicates[-1][-1] == name_a:
+                duplicates[-1].append(name_b)
+            else:
+                duplicates.append([name_a, name_b])
+        steps = [b - a for a, b in zip(numbers, numbers[1:])]
+        if not steps:
+            continue
+        step = Counter(steps).most_common(1)[0][0]
+        for a, b in zip(numbers, numbers[1:]):
+            if b - a > step:
+                if (b - a) % step:
+                    gaps.append((prefix, a + 1, b - 1))
+                else:
+                    gaps.append((prefix, a + step, b - step))
+    return Numbering(gaps, duplicates)
+
+
+def render(spec: RenderSpec, files: list[str], progress=None,
+           cache: FrameCache | None = None, force: bool = False,
+           trace: RenderTrace | None = None,
+           memory: MemoryEstimate | None = None,
+           cancel: threading.Event | None = None) -> RenderResult:
+    """Render ``files`` (names inside ``spec.folder``, in order) to one animation.
+
+    ``progress(fraction)`` is called each time a source frame is consumed
+    (from the segment threads when ``spec.segments`` > 1); frames are pulled
+    by the encoder, so it tracks the whole job. With a ``cache``, processed frames are re-used across
+    renders whose processing settings match.
+
+    A manifest is written next to the output; unless ``force`` is set, a
+    render whose inputs, order and settings match it is skipped and
+    reported with ``up_to_date=True``.
+
+    With a ``trace``, every stage is timed into it and the result carries
+    its ``report()``.
+
+    Before any frame is decoded, frame headers are checked (see
+    ``check_frames``; errors raise ValueError, warnings end up in the
+    result) and the job is fitted to ``spec.memory_budget_mb`` (see
+    ``plan_memory``); pass ``memory`` to re-use a plan already made for
+    these files.
+
+    The output is written to a hidden temporary file and renamed into
+    place when complete, so a failed render never leaves a partial file
+    (or destroys the previous output). Setting ``cancel`` stops the render
+    before its next frame with RenderCancelled.
+    """
+    if trace is None:
+        return _render(spec, files, progress, cache, force, memory, cancel)
+    token = _current_trace.set(trace)
+    cpu, child_cpu = time.process_time(), _children_cpu()
+    try:
+        result = _render(spec, files, progress, cache, force, memory, cancel)
+    finally:
+        _current_trace.reset(token)
+    child_cpu = _children_cpu() - child_cpu
+    if spec.fmt == "MP4":
+        trace.add_cpu("encode", child_cpu)  # ffmpeg's own work
+        trace.add_bytes("write", 0 if result.up_to_date else result.output_bytes)
+    trace.totals = {
+        "output_path": result.output_path,
+        "up_to_date": result.up_to_date,
+        "frames_in": result.frames_in,
+        "frames_out": result.frames_out,
+        "output_bytes": result.output_bytes,
+        "wall_seconds": round(result.seconds, 6),
+        "cpu_seconds": round(time.process_time() - cpu + child_cpu, 6),
+        "peak_rss_bytes": _peak_rss(),
+    }
+    result.report = trace.report()
+    return result
+
+
+def _render(spec: RenderSpec, files: list[str], progress, cache: FrameCache | None,
+            force: bool, memory: MemoryEstimate | None,
+            cancel: threading.Event | None) -> RenderResult:
+    spec.validate()
+    if not files:
+        raise ValueError("No frames to render.")
+    start = time.perf_counter()
+    path = spec.output_path()
+    if not force:
+        stored = check_up_to_date(spec, files)
+        if stored is not None:
+            return RenderResult(
+                output_path=path,
+                frames_in=len(files),
+                frames_out=stored.get("frames_out", 0),
+                output_bytes=stored["output"][0],
+                seconds=time.perf_counter() - start,
+                up_to_date=True,
+            )
+    # Catch bad frames from their headers, before minutes of work
+    infos = FolderIndex(spec.folder).scan(files, spec.workers, cancel)
+    check = check_frames(infos, spec)
+    if check.errors:
+        raise ValueError(" ".join(check.errors))
+    # Pick the video encoder up front: a missing codec should fail now, not
+    # after every frame has been processed.
+    mp4_encoder = select_mp4_encoder() if spec.fmt == "MP4" else None
+    manifest = build_manifest(spec, files)
+    try:
+        os.remove(manifest_path(path))  # stale until the new output is complete
+    except FileNotFoundError:
+        pass
+    paths = [os.path.join(spec.folder, f) for f in files]
+    memory = memory or plan_memory(spec, files, [(i.width, i.height) for i in infos])
+    workers = memory.workers
+    spill = SpillStore() if memory.spill else None
+
+    # One palette pass per output frame; MP4 only needs it to honour an
+    # explicit COLORS limit.
+    quantize = None
+    palette_tag = None
+    if spec.fmt == "GIF" or spec.colors < 256:
+        if spec.global_palette:
+            with span("quantize"):
+                palette = GlobalPalette.from_files(paths, spec.colors, cancel)
+            quantize = partial(palette.apply, dither_method=spec.dither)
+            palette_tag = hashlib.sha256(bytes(palette.palette)).hexdigest()
+        else:
+            quantize = partial(quantize_frame, num_colors=spec.colors,
+                               dither_method=spec.dither)
+
+    tracker = _Progress(progress, len(paths))
+    # A sequence larger than the cache would only churn it: read, don't write
+    cache_store = cache is not None and cache.fits(len(paths), memory.frame_size)
+    make_stream = partial(_frame_stream, spec=spec, quantize=quantize,
+                          palette_tag=palette_tag, on_frame=tracker.step, cache=cache,
+                          cache_store=cache_store, spill=spill)
+    # Segmenting only pays off when every encoder gets a real share of frames
+    segments = min(spec.segments, len(paths) // MIN_SEGMENT_SOURCES)
+    partial_path = _partial_path(path)
+    try:
+        if spec.fmt == "MP4" and segments > 1:
+            chunks = _split_segments(paths, segments, overlap=spec.dissolve > 0)
+            tracker.total = sum(len(c) for c in chunks)
+            per_segment = max(1, workers // segments)
+            streams = [make_stream(chunk, workers=per_segment) for chunk in chunks]
+            if spec.dissolve > 0:
+                # Each chunk but the last repeats the next chunk's first source
+                # so the cross-fade into it is kept; drop that repeat
+                streams = [_drop_last(st) for st in streams[:-1]] + streams[-1:]
+            streams = [_until_cancelled(st, cancel) for st in streams]
+            ffmpeg_exe, encoder = mp4_encoder
+            frames_out = encode_mp4_segments(streams, partial_path, ffmpeg_exe,
+                                             spec.speed_ms, encoder, threads=per_segment,
+                                             cancel=cancel)
+        else:
+            frames = _until_cancelled(make_stream(paths, workers=workers), cancel)
+            long_job = len(paths) * max(1, spec.dissolve + 1) >= PARALLEL_ENCODE_MIN_FRAMES
+            frames_out = write_output(frames, partial_path, spec,
+                                      encode_workers=workers if long_job else 1,
+                                      mp4_encoder=mp4_encoder, cancel=cancel)
+        os.replace(partial_path, path)
+    except BaseException:
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+        raise
+    finally:
+        if cache is not None:
+            cache.flush()
+    _write_manifest(manifest, path, frames_out)
+    return RenderResult(
+        output_path=path,
+        frames_in=len(paths),
+        frames_out=frames_out,
+        output_bytes=os.path.getsize(path),
+        seconds=time.perf_counter() - start,
+        memory=memory,
+        warnings=check.warnings,
+    )
+
+
+class RenderCancelled(Exception):
+    """Raised by ``render`` when its ``cancel`` event is set mid-job."""
+
+
+def _until_cancelled(frames, cancel: threading.Event | None):
+    """Pass ``frames`` through, checking ``cancel`` before each one."""
+    if cancel is None:
+        yield from frames
+        return
+    for frame in frames:
+        if cancel.is_set():
+            raise RenderCancelled("Cancelled")
+        yield frame
+    if cancel.is_set():
+        raise RenderCancelled("Cancelled")
+
+
+def _partial_path(path: str) -> str:
+    """Hidden name ``path`` is written under until it is complete.
+
+    The extension is kept, since ffmpeg picks the container from it.
+    """
+    folder, name = os.path.split(path)
+    root, ext = os.path.splitext(name)
+    return os.path.join(folder, f".{root}.{os.getpid()}-{threading.get_ident()}.partial{ext}")
+
+
+# Fewest source frames worth giving their own encoder process
+MIN_SEGMENT_SOURCES = 8
+
+
+class _Progress:
+    """Thread-safe frame counter reporting ``progress(fraction)``."""
+
+    def __init__(self, callback, total: int):
+        self.callback = callback
+        self.total = total
+        self._done = 0
+        self._lock = threading.Lock()
+
+    def step(self):
+        if self.callback is None:
+            return
+        with self._lock:
+            self._done += 1
+            fraction = self._done / self.total
+        self.callback(fraction)
+
+
+def _split_segments(paths: list[str], segments: int, overlap: bool) -> list[list[str]]:
+    """Split ``paths`` into ``segments`` near-equal consecutive chunks.
+
+    With ``overlap`` each chunk but the last also ends with the next chunk's
+    first path.
+    """
+    bounds = [len(paths) * i // segments for i in range(segments + 1)]
+    return [paths[a:b + 1 if overlap and b < len(paths) else b]
+            for a, b in zip(bounds, bounds[1:])]
+
+
+def _drop_last(iterable):
+    """Yield every item of ``iterable`` except the last."""
+    it = iter(iterable)
+    try:
+        prev = next(it)
+    except StopIteration:
+        return
+    for item in it:
+        yield prev
+        prev = item
+
+
+def _frame_stream(paths: list[str], spec: RenderSpec, quantize, palette_tag,
+                  workers: int, on_frame=None, cache: FrameCache | None = None,
+                  cache_store: bool = True, spill: SpillStore | None = None):
+    """Build the lazy load -> dissolve -> palette pipeline over ``paths``.
+
+    Every stage is a generator, so only a couple of frames are alive at once
+    no matter how long the sequence is. With a ``spill`` store, the frames
+    each stage has finished wait for the next one on disk. Only palette
+    frames go through the ``cache``: a decoded full-colour frame is several
+    times the size of its source file.
+    """
+    keep = spill.wrap if spill is not None else lambda func: func
+    load = partial(load_frame, resample=spec.scale)
+    if spec.dissolve == 0 and quantize is not None:
+        # Each output frame comes from exactly one source: do (and cache)
+        # the whole per-frame job in one step.
+        stage = lambda path: quantize(load(path))
+        params = ("frame", spec.scale, spec.colors, spec.dither, palette_tag)
+        return _iter_source_frames(paths, stage, params, workers, on_frame, cache,
+                                   cache_store, spill)
+    frames = _iter_source_frames(paths, load, (), workers, on_frame, spill=spill)
+    if spec.dissolve > 0:
+        frames = iter_dissolve(frames, spec.dissolve, deferred=True)
+    # Deferred blends are computed by the same workers as the palette pass
+    if quantize is not None:
+        frames = ordered_map(keep(lambda f: quantize(materialize(f))), frames, workers)
+    elif spec.dissolve > 0:
+        frames = ordered_map(keep(materialize), frames, workers)
+    return frames
+
+
+def _iter_source_frames(paths: list[str], stage, params: tuple, workers: int,
+                        on_frame=None, cache: FrameCache | None = None,
+                        cache_store: bool = True, spill: SpillStore | None = None):
+    """Yield ``stage(path)`` for every path, in order, on a worker pool."""
+    if cache is not None:
+        stage = cache.wrap(stage, params, store=cache_store)
+    if spill is not None:
+        stage = spill.wrap(stage)  # cache hits too
+    for img in ordered_map(stage, paths, workers):
+        yield img
+        if on_frame is not None:
+            on_frame()
+
+
+# Below this many frames, starting encoder processes costs more than it saves
+PARALLEL_ENCODE_MIN_FRAMES = 24
+
+
+def write_output(frames, path: str, spec: RenderSpec, encode_workers: int = 1,
+                 mp4_encoder: tuple[str, str] | None = None,
+                 cancel: threading.Event | None = None) -> int:
+    """Encode an iterable of frames to ``path``, consuming it frame by frame.
+
+    ``encode_workers`` > 1 compresses GIF frames in that many processes.
+    ``mp4_encoder`` is an ``(ffmpeg path, encoder)`` pair from
+    ``select_mp4_encoder``; it is looked up here if not given. ``cancel``
+    stops ffmpeg while it finishes. Returns the number of frames written.
+    """
+    if spec.fmt == "GIF":
+        with GifStreamWriter(path, loop=0, delta=True, workers=encode_workers) as writer:
+            for img in frames:
+                writer.add_frame(img, spec.speed_ms)
+        return writer.frames_written
+    ffmpeg_exe, encoder = mp4_encoder or select_mp4_encoder()
+    return encode_mp4_stream(frames, path, ffmpeg_exe, spec.speed_ms, encoder, cancel=cancel)
+
+
+# ---------------------------------------------------------------------------
+# Job queue
+# ---------------------------------------------------------------------------
+class RenderJob:
+    """One render submitted to a JobExecutor.
+
+    ``state`` goes from "queued" to "running" to one of "done", "failed"
+    or "cancelled"; ``result``, ``error`` and ``memory`` (the pre-flight
+    plan, set when the job starts) are filled in along the way.
+    """
+
+    def __init__(self, job_id: int, spec: RenderSpec, files: list[str], priority: int,
+                 render_kwargs: dict):
+        self.id = job_id
+        self.spec = spec
+        self.files = files
+        self.priority = priority
+        self.render_kwargs = render_kwargs
+        self.state = "queued"
+        self.progress = 0.0
+        self.memory: MemoryEstimate | None = None
+        self.result: RenderResult | None = None
+        self.error: str | None = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.spec.output_path())
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("done", "failed", "cancelled")
+
+
+class JobExecutor:
+    """Runs render jobs from a priority queue on background threads.
+
+    Higher ``priority`` runs first and equal priorities run in the order
+    they were submitted. ``concurrency`` jobs run at once (default one:
+    each render already uses every core). ``on_change(job)`` is called
+    from a worker thread whenever a job is queued, starts, reports
+    progress or finishes. Cancelling a running job stops it before its
+    next frame and removes its partial output; ``shutdown`` does that for
+    every job, so closing an app never leaves a half-written file.
+    """
+
+    def __init__(self, on_change=None, concurrency: int = 1):
+        self.on_change = on_change
+        self._queue: list[tuple[int, int, RenderJob]] = []  # heap of (-priority, seq, job)
+        self._running: list[RenderJob] = []
+        self._seq = itertools.count()
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work, name=f"render-job-{i}",
+                                          daemon=True) for i in range(max(1, concurrency))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, spec: RenderSpec, files: list[str], priority: int = 0,
+               **render_kwargs) -> RenderJob:
+        """Queue a render; ``render_kwargs`` go to ``render`` (cache, trace, ...)."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The job queue has been shut down.")
+            job = RenderJob(next(self._ids), spec, list(files), priority, render_kwargs)
+            heapq.heappush(self._queue, (-priority, next(self._seq), job))
+            self._cond.notify()
+        self._changed(job)
+        return job
+
+    def jobs(self) -> list[RenderJob]:
+        """Running jobs, then queued ones in the order they will run."""
+        with self._cond:
+            return list(self._running) + [job for _, _, job in sorted(self._queue)]
+
+    def set_priority(self, job: RenderJob, priority: int):
+        """Move a queued job; it runs after others already at ``priority``."""
+        with self._cond:
+            if not self._remove(job):
+                return
+            job.priority = priority
+            heapq.heappush(self._queue, (-priority, next(self._seq), job))
+        self._changed(job)
+
+    def cancel(self, job: RenderJob):
+        """Drop a queued job, or stop a running one before its next frame."""
+        job.cancel_event.set()
+        with self._cond:
+            dropped = self._remove(job)
+            if dropped:
+                job.state = "cancelled"
+        if dropped:
+            self._changed(job)
+
+    def shutdown(self, cancel: bool = True, timeout: float | None = None) -> bool:
+        """Stop taking jobs and wait for the workers.
+
+        With ``cancel`` the queue is dropped and running jobs are stopped;
+        otherwise every queued job runs first. Returns False if a worker
+        was still busy after ``timeout`` seconds.
+        """
+        with self._cond:
+            self._closed = True
+            dropped = [job for _, _, job in self._queue] if cancel else []
+            if cancel:
+                self._queue.clear()
+                for job in self._running:
+                    job.cancel_event.set()
+            for job in dropped:
+                job.cancel_event.set()
+                job.state = "cancelled"
+            self._cond.notify_all()
+        for job in dropped:
+            self._changed(job)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def _remove(self, job: RenderJob) -> bool:
+        """Take ``job`` out of the queue (call with the lock held)."""
+        for i, entry in enumerate(self._queue):
+            if entry[2] is job:
+                self._queue.pop(i)
+                heapq.heapify(self._queue)
+                return True
+        return False
+
+    def _changed(self, job: RenderJob):
+        if self.on_change is not None:
+            self.on_change(job)
+
+    def _progress(self, job: RenderJob, fraction: float):
+        job.progress = fraction
+        self._changed(job)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                _, _, job = heapq.heappop(self._queue)
+                job.state = "running"
+                self._running.append(job)
+            try:
+                kwargs = dict(job.render_kwargs)
+                job.memory = (kwargs.pop("memory", None)
+                              or plan_memory(job.spec, job.files, cancel=job.cancel_event))
+                self._changed(job)
+                job.result = render(job.spec, job.files, progress=partial(self._progress, job),
+                                    memory=job.memory, cancel=job.cancel_event, **kwargs)
+                job.progress = 1.0
+                job.state = "done"
+            except RenderCancelled:
+                job.state = "cancelled"
+            except Exception as e:
+                job.error = str(e) or type(e).__name__
+                job.state = "failed"
+            finally:
+                with self._cond:
+                    self._running.remove(job)
+            self._changed(job)